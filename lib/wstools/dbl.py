@@ -34,10 +34,28 @@ import xml.etree.ElementTree as ET
 from shutil import copy
 from datetime import datetime
 from wsgiref.handlers import format_date_time
+import time
 from time import mktime
 
 dblurl='https://api.thedigitalbiblelibrary.org'
 
+try:
+    from wstools.dblhttp import SessionPool, RetryPolicy, RateLimiter, get as httpget, streamResponse
+except ImportError:
+    from dblhttp import SessionPool, RetryPolicy, RateLimiter, get as httpget, streamResponse
+try:
+    from wstools.dblindex import ProjectIndex, sharedZip, openNested
+except ImportError:
+    from dblindex import ProjectIndex, sharedZip, openNested
+try:
+    from wstools.dblcorpus import defaultTextCache
+except ImportError:
+    from dblcorpus import defaultTextCache
+try:
+    from wstools.dblusx import iterParagraphs, compileStylesheet, ARABIC_STYLE_IDS
+except ImportError:
+    from dblusx import iterParagraphs, compileStylesheet, ARABIC_STYLE_IDS
+
 try:
     from sldr.ldml_exemplars import Exemplars
 except ImportError:
@@ -162,11 +180,26 @@ class DBLAuthV1(requests.auth.AuthBase):
 
 
 class DBLReader(object):
-    def __init__(self, key1 = None, key2 = None):
+    def __init__(self, key1 = None, key2 = None, poolsize=10, keepalive=True, retry=None, limiter=None):
         if key1 is None or key2 is None:
             key1, key2 = getdblkeys()
         self.secretKey = key2
         self.auth = DBLAuthV1(key1, key2)
+        self.sessions = SessionPool(poolsize=poolsize, keepalive=keepalive)
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.limiter = limiter
+
+    @property
+    def session(self):
+        """ The pooled keep-alive session for this process and thread """
+        return self.sessions.get()
+
+    def _get(self, url, headers, **kw):
+        """ Signed GET through the pooled session, rate limited and retried """
+        return httpget(self.session, url, headers, retry=self.retry, limiter=self.limiter, auth=self.auth, **kw)
+
+    def close(self):
+        self.sessions.close()
 
     def download(self, downloadDir, lang=None, skiplangs=['en', 'eng', 'es'], update=False, allids=False, srcdir=None):
         entriesDict = self.getEntries(allids=allids)
@@ -200,12 +233,11 @@ class DBLReader(object):
         
 
     def testAccess(self):
-        response = requests.get(dblurl,
-                                auth=self.auth, headers=self._jsonHeaders())
+        response = self._get(dblurl, self._jsonHeaders)
         return response.status_code
 
     def getjson(self, url):
-        response = requests.get(url, auth=self.auth, headers=self._jsonHeaders())
+        response = self._get(url, self._jsonHeaders)
         if response.status_code == 200:
             return (json.loads(response.content), response.status_code)
         else:
@@ -281,14 +313,14 @@ class DBLReader(object):
 
         if downloadZip:
             url = entryData['href'] + "/license/" + licenseId + ".zip"
-            response = requests.get(url, auth=self.auth, headers=self._jsonHeaders())
-            if response.status_code == 200:
-                downloadFileName = langCode + "_" + entryId + ".zip"
-                self._saveDownloadedFile(downloadPath, downloadFileName, response.content)
-                result = downloadPath + "/" + downloadFileName
-                logging.debug(langCode + " - DOWNLOADED " + downloadFileName)
-            else:
-                logging.warn(langCode + " - can't download zip file: {}, {}".format(response.status_code, url)) 
+            with self._get(url, self._jsonHeaders, stream=True) as response:
+                if response.status_code == 200:
+                    downloadFileName = langCode + "_" + entryId + ".zip"
+                    self._saveDownloadedStream(downloadPath, downloadFileName, response)
+                    result = downloadPath + "/" + downloadFileName
+                    logging.debug(langCode + " - DOWNLOADED " + downloadFileName)
+                else:
+                    logging.warn(langCode + " - can't download zip file: {}, {}".format(response.status_code, url)) 
         else:
             logging.warn(langCode + " - no usx files")
         return result
@@ -304,21 +336,41 @@ class DBLReader(object):
         with open(fullname, "wb") as outf:
             outf.write(contents)
 
+    def _saveDownloadedStream(self, dirPath, filename, response):
+        if not os.path.exists(dirPath):
+            os.makedirs(dirPath)
+        fullname = os.path.join(dirPath, filename)
+        with open(fullname, "wb") as outf:
+            streamResponse(response, outf)
+
 #end of class DBLReader
 def main():
     pass
 
 
+def book_text(job):
+    """ Pool worker for DBL.analyze_text: the paragraphs of one book of a project """
+    (dblobj, filename) = job
+    return dblobj.book_text(filename)
+
+
 class DBL(object):
+    # Bump this whenever a change alters the text analyze_text yields or how it is cached, to invalidate cached text
+    textrules = "dbl-3"
     def __init__(self, zipfilename):
         self.project = None
+        self.source = None
         self.publishable = set()
+        self.accepted = frozenset()
         self.main_text = ('ip', 's', 'p', 'q')
+        self.textcache = defaultTextCache()
+        self.zipfilename = zipfilename
         self.project = zipfile.ZipFile(zipfilename, 'r')
+        self.index = ProjectIndex(self.project.namelist())
 
     def namelist(self):
         """ Return the zip file namelist """
-        return self.project.namelist()
+        return self.index.names
 
     def query_project(self):
         """Query a DBL project for ad-hoc information.
@@ -329,111 +381,206 @@ class DBL(object):
 
         # Find stylesheets.
         found = False
-        for filename in self.project.namelist():
-            if os.path.basename(filename) == 'styles.xml':
-                found = True
-                print(filename)
+        for filename in self.index.withRole('stylesheet'):
+            found = True
+            print(filename)
         if not found:
             print("not found!")
 
-    def analyze_text(self):
-        """Analyse the scripture text. Iterates yielding text strings"""
+    def analyze_text(self, pool=None):
+        """Analyse the scripture text. Iterates yielding text strings.
+        Given a multiprocessing pool, the books are extracted in parallel,
+        each worker opening the zip for itself, and the text comes back in
+        the same order as it would without. If the zip is unchanged since
+        its text was last extracted the text comes from self.textcache."""
+        for para in self._paragraphs(pool):
+            for run in para:
+                for text in run:
+                    yield text
 
+    def analyze_batches(self, by='paragraph', size=4096, pool=None):
+        """Analyse the scripture text, yielding it in lists of strings rather
+        than a string at a time. by is 'paragraph' for a list per paragraph,
+        'verse' for a list per verse (and per stretch of a paragraph before
+        its first verse), or 'chunk' for lists of at least size characters
+        (bar the last). The strings, and their order, are exactly those of
+        analyze_text; only empty batches are left out."""
+        if by not in ('paragraph', 'verse', 'chunk'):
+            raise ValueError("Unknown batch type {}".format(by))
+        batch = []
+        length = 0
+        for para in self._paragraphs(pool):
+            if by == 'verse':
+                for run in para:
+                    yield run
+            elif by == 'paragraph':
+                yield [text for run in para for text in run]
+            else:
+                for run in para:
+                    batch.extend(run)
+                    length += sum(map(len, run))
+                if length >= size:
+                    yield batch
+                    batch = []
+                    length = 0
+        if len(batch):
+            yield batch
+
+    def _paragraphs(self, pool=None):
+        """The accepted paragraphs of the text as lists of verse runs, from
+        self.textcache if possible. Each run is a non-empty list of strings."""
+        if self.textcache is not None and self.zipfilename is not None:
+            rules = "{}:{}".format(self.textrules, ",".join(self.main_text))
+            paras = self.textcache.get(self.zipfilename, rules)
+            if paras is None:
+                paras = self.textcache.put(self.zipfilename, rules, self._extract_text(pool))
+        else:
+            paras = self._extract_text(pool)
+        return paras
+
+    def _extract_text(self, pool=None):
+        """Extract the paragraphs from the zip itself, as _paragraphs describes."""
         # Read stylesheet.
         found_stylesheet = False
-        for filename in self.project.namelist():
-            if os.path.basename(filename) == 'styles.xml':
-                found_stylesheet = True
-                style = self.project.open(filename, 'r')
-                self._read_stylesheet(style)
+        for filename in self.index.withRole('stylesheet'):
+            found_stylesheet = True
+            style = self.project.open(filename, 'r')
+            self._read_stylesheet(style)
         if not found_stylesheet:
             raise IOError('stylesheet not found')
 
         # Process text data.
-        for filename in self.project.namelist():
-            if filename.endswith('.usx'):
-                usx = self.project.open(filename, 'r')
-                for text in self._process_usx_file(usx):
-                    yield text
-                    # self.exemplars.process(text)
-                    # self.corpus.write(text + '\n')
+        if pool is not None:
+            for paras in pool.imap(book_text, [(self, f) for f in self.index.withExt('usx')]):
+                for para in paras:
+                    yield para
+            return
+        for filename in self.index.withExt('usx'):
+            usx = self.project.open(filename, 'r')
+            for para in self._process_usx_paragraphs(usx):
+                yield para
+                # self.exemplars.process(text)
+                # self.corpus.write(text + '\n')
+
+    def book_text(self, filename):
+        """Return the paragraphs of one USX member as a list."""
+        if self.project is None:
+            self.project = sharedZip(self.zipfilename)
+        return list(self._process_usx_paragraphs(self.project.open(filename, 'r')))
 
     def _read_stylesheet(self, style):
-        """Read stylesheet and record which markers are publishable."""
-        tree = ET.parse(style)
-        for marker in tree.findall('style'):
-            if marker.get('publishable') == 'true':
-                self.publishable.add(marker.get('id'))
+        """Read stylesheet and record which markers are publishable, and which
+        of those are main text."""
+        # ARABIC_STYLE_IDS is specifically for arq which has a stylesheet with some arabic ids for some reason
+        (publishable, accepted) = compileStylesheet(style, self.main_text, also=('m',), remap=ARABIC_STYLE_IDS)
+        self.publishable.update(publishable)
+        self.accepted |= accepted
 
     def _process_usx_file(self, usx):
-        """Process one USX file."""
-        tree = ET.parse(usx)
-        root = next(tree.iter())
-        publish = list(self.publishable)
-        arabic_style_ids = {'ك':'id', 'عك':'h', 'م':'imt', 'مف':'ip', 'ص':'c', 'ي':'v', 'ف':'p', 'ف 1':'m', 'ف 2':'nb', 'ش':'q', 'ش1':'q1', 'ش2':'q2', 'س':'qs', 'شغ':'b', 'عر':'mt', 'عر1':'mt1', 'عر2':'mt2', 'عق':'ms', 'عق1':'mr', 'ع':'s', 'ع1':'s1', 'ع2':'s2', 'عش':'r', 'عم':'sp', 'عج':'d', 'ت':'f', 'تش':'fr', 'تن':'ft', 'تنش':'fq', 'تشم':'x', 'تشل':'xo', 'تشت':'xt', 'صو':'fig'}   
-            # specifically for arq which has a stylesheet with some arabic ids for some reason
-        for x in publish:
-            if x in arabic_style_ids.keys():
-                self.publishable.pop()
-                self.publishable.add(arabic_style_ids[x])
-        for marker in list(root):
-            style = marker.get('style')
-            if style in self.publishable and (style.startswith(self.main_text) or style == ('m')):
-                for text in self._get_text(marker):
+        """Process one USX file, a paragraph at a time."""
+        for para in self._process_usx_paragraphs(usx):
+            for run in para:
+                for text in run:
                     yield text
+
+    def _process_usx_paragraphs(self, usx):
+        """Process one USX file, yielding each accepted paragraph as a list of
+        runs of text, split where a verse starts."""
+        for marker in iterParagraphs(usx):
+            if marker.get('style') in self.accepted:
+                runs = [[]]
+                for text in self._get_text(marker, verses=True):
+                    if text is not None:
+                        runs[-1].append(text)
+                    elif len(runs[-1]):
+                        runs.append([])
+                if not len(runs[-1]):
+                    runs.pop()
+                if len(runs):
+                    yield runs
         usx.close()
 
     def file_contents_with_ext(self, ext):
         """Return the contents of the file with the given extension, if any."""
-        for filename in self.project.namelist():
-            if filename.endswith('.'+ext):
-                contents = self.project.open(filename, 'r')
-                return contents
+        filename = self.index.firstWithExt(ext)
+        if filename is not None:
+            return self.project.open(filename, 'r')
         return None
 
     def extract_file_with_ext(self, ext, newname=None):
         """Return the contents of the file with the given extension, if any."""
-        for filename in self.project.namelist():
-            if filename.endswith('.' + ext):
-                self.project.extract(filename)
-                if newname is not None:
-                    if os.path.exists(newname):
-                        os.remove(newname)
-                    copy(filename, newname)
-                    os.remove(filename)
-                return
+        filename = self.index.firstWithExt(ext)
+        if filename is not None:
+            self.project.extract(filename)
+            if newname is not None:
+                if os.path.exists(newname):
+                    os.remove(newname)
+                copy(filename, newname)
+                os.remove(filename)
 
     def extract_file(self, filename):
-        if filename in self.project.namelist():
+        if filename in self.index:
             self.project.extract(filename)
             return True
         else:
             return False
 
-    def _get_text(self, element):
+    def _get_text(self, element, verses=False):
         """Extract all text from an ET Element."""
         # for text in element.itertext():
-        for text in self.iter_main_text(element):
-            yield text.strip()
-
-    def iter_main_text(self, element):
-        """Extract all text (except notes) from an ET Element."""
-        if element.tag == 'note':
-            return
-        if element.text:
-            if element.text.strip():
-                yield element.text
-        if element.tail:
-            if element.tail.strip():
-                yield element.tail
-        for e in element:
-            for se in self.iter_main_text(e):
-                yield se
+        for text in self.iter_main_text(element, verses):
+            yield text.strip() if text is not None else None
+
+    def iter_main_text(self, element, verses=False):
+        """Extract all text (except notes) from an ET Element. If verses is
+        set, None is yielded where each verse starts."""
+        # Each element's text and tail come before its children. Walk the tree
+        # with an explicit stack rather than nested generators.
+        stack = [element]
+        while len(stack):
+            e = stack.pop()
+            if e.tag == 'note':
+                # The note is dropped but the text after it is main text
+                if e.tail and e.tail.strip():
+                    yield e.tail
+                continue
+            if verses and e.tag == 'verse':
+                yield None
+            if e.text and e.text.strip():
+                yield e.text
+            if e.tail and e.tail.strip():
+                yield e.tail
+            stack.extend(reversed(e))
+
+    def open_source(self):
+        """Return the project's source/source.zip as a ZipFile, or None if it
+        has none. It is unpacked once and kept until close_project."""
+        if self.source is None:
+            try:
+                self.source = openNested(self.project, "source/source.zip")
+            except KeyError:
+                return None
+        return self.source
 
     def close_project(self):
         """Close a DBL project."""
         self.project.close()
+        if self.source is not None:
+            self.source.close()
+            self.source = None
         # self.corpus.close()
 
+    # Pool workers get just what they need to extract text, and open the zip themselves
+    def __getstate__(self):
+        return {'zipfilename': self.zipfilename, 'publishable': self.publishable,
+                'accepted': self.accepted, 'main_text': self.main_text}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.project = None
+        self.source = None
+        self.index = None
+        self.textcache = None
+
 if __name__ == '__main__':
     main()
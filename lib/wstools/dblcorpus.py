@@ -0,0 +1,135 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+# A persistent cache of the main text extracted from DBL project zips
+
+import os
+import gzip
+import json
+import hashlib
+import sqlite3
+import tempfile
+
+# Size of the pieces zips are hashed in
+CHUNKSIZE = 1024 * 1024
+
+
+class TextCache(object):
+    """Compressed copies of the text extracted from each project.
+
+    Entries are keyed by the zip's content digest and the extraction rules,
+    so a change to either misses. The digest of each zip path is kept
+    with the size and mtime it was taken at, and is only recomputed when
+    those change, so a rerun over an unchanged DBL mirror costs a stat
+    per zip. Several processes may share a cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.db = None
+
+    def _db(self):
+        # Connected on first use, so that a cache can be handed to pool workers
+        if self.db is None or self._pid != os.getpid():
+            self.db = sqlite3.connect(os.path.join(self.path, "zips.db"), timeout=60)
+            self._pid = os.getpid()
+            with self.db:
+                self.db.execute("""CREATE TABLE IF NOT EXISTS zips (
+                                    path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, digest TEXT)""")
+        return self.db
+
+    def digest(self, zipfilename):
+        """ The content digest of a zip, from the index if it has not changed """
+        path = os.path.abspath(zipfilename)
+        st = os.stat(path)
+        db = self._db()
+        row = db.execute("SELECT size, mtime, digest FROM zips WHERE path=?", (path,)).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        h = hashlib.sha1()
+        with open(path, "rb") as inf:
+            while True:
+                chunk = inf.read(CHUNKSIZE)
+                if not chunk:
+                    break
+                h.update(chunk)
+        res = h.hexdigest()
+        with db:
+            db.execute("INSERT OR REPLACE INTO zips VALUES (?, ?, ?, ?)", (path, st.st_size, st.st_mtime_ns, res))
+        return res
+
+    def _entry(self, zipfilename, rules):
+        digest = self.digest(zipfilename)
+        ruleshash = hashlib.sha1(rules.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self.path, digest[:2], "{}-{}.txt.gz".format(digest, ruleshash))
+
+    def get(self, zipfilename, rules):
+        """ An iterator over the cached text of a project, or None if there is none """
+        try:
+            inf = gzip.open(self._entry(zipfilename, rules), "rt", encoding="utf-8")
+        except FileNotFoundError:
+            return None
+        return self._read(inf)
+
+    def put(self, zipfilename, rules, texts):
+        """Pass texts through, caching them for zipfilename if they run to
+        the end. Nothing is cached if the caller stops early or extraction
+        fails."""
+        entry = self._entry(zipfilename, rules)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        (fd, tmppath) = tempfile.mkstemp(dir=os.path.dirname(entry), suffix=".tmp")
+        os.close(fd)
+        done = False
+        try:
+            with gzip.open(tmppath, "wt", encoding="utf-8") as outf:
+                for text in texts:
+                    outf.write(json.dumps(text, ensure_ascii=False) + "\n")
+                    yield text
+            os.replace(tmppath, entry)
+            done = True
+        finally:
+            if not done:
+                os.unlink(tmppath)
+
+    def _read(self, inf):
+        with inf:
+            for l in inf:
+                yield json.loads(l)
+
+
+def defaultTextCache():
+    """The cache named by $WSTOOLS_TEXTCACHE, or one under the user's cache
+    directory if that is not set. Setting WSTOOLS_TEXTCACHE to nothing
+    turns caching off."""
+    path = os.getenv("WSTOOLS_TEXTCACHE", None)
+    if path is None:
+        base = os.getenv("XDG_CACHE_HOME", None) or os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, "wstools", "text")
+    elif path == "":
+        return None
+    try:
+        return TextCache(path)
+    except OSError:
+        return None
@@ -0,0 +1,249 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+# Exemplar counting that can be sharded across processes and merged
+
+import copy
+import codecs
+import logging
+from collections import Counter, deque
+
+from sldr.ldml_exemplars import Exemplars
+
+logger = logging.getLogger(__name__)
+
+# Shards of text are sent to workers once they hold this many characters
+SHARDCHARS = 256 * 1024
+
+# Attribute values of these types are part of the state that is carried between processes
+_simple = (str, int, float, bool, bytes, tuple, type(None), set, frozenset, list, dict, Counter)
+
+
+class MergeError(ValueError):
+    """Partial exemplar state that cannot be merged and give exactly what
+    processing the text serially would."""
+    pass
+
+
+def snapshot(exemplars):
+    """ A deep copy of the attributes of an Exemplars that are plain data """
+    return {k: copy.deepcopy(v) for k, v in vars(exemplars).items() if isinstance(v, _simple)}
+
+
+def changes(template, exemplars):
+    """ The attributes of exemplars that differ from the template snapshot """
+    return {k: v for k, v in snapshot(exemplars).items() if k not in template or template[k] != v}
+
+
+_containers = (Counter, set, frozenset, list, dict)
+
+
+def _check(base, template, new):
+    # Can new, grown from template, be merged into base? Raises MergeError if not
+    if isinstance(new, (Counter, set, frozenset)):
+        return
+    if isinstance(new, list):
+        if not isinstance(template, list) or new[:len(template)] != template:
+            raise MergeError("list was not appended to")
+    elif isinstance(new, dict):
+        if not isinstance(template, dict) or not isinstance(base, dict):
+            raise MergeError("dict replaced")
+        for k, v in new.items():
+            if k in base and isinstance(v, _containers) and template.get(k, None) != v:
+                _check(base[k], template.get(k, type(v)()), v)
+    elif new != template:
+        raise MergeError("value changed")
+
+
+def _merge(base, template, new):
+    # Merge what new added to template into base, returning the result
+    if isinstance(new, Counter):
+        for k, v in new.items():
+            d = v - template.get(k, 0)
+            if d:
+                base[k] += d
+    elif isinstance(new, (set, frozenset)):
+        base = base | new
+    elif isinstance(new, list):
+        base.extend(new[len(template):])
+    elif isinstance(new, dict):
+        for k, v in new.items():
+            if k in template and template[k] == v:
+                continue
+            if k in base and isinstance(v, _containers):
+                base[k] = _merge(base[k], template.get(k, type(v)()), v)
+            else:
+                # A plain value is as the last shard to set it left it
+                base[k] = copy.deepcopy(v)
+    return base
+
+
+def _shard(job):
+    """ Pool worker: process a shard into a fresh Exemplars, returning its changes """
+    (template, options, source) = job
+    exemplars = Exemplars()
+    for k, v in template.items():
+        setattr(exemplars, k, copy.deepcopy(v))
+    start = snapshot(exemplars)
+    if isinstance(source, list):
+        for t in source:
+            exemplars.process(t, **options)
+    else:
+        for t in _sourceText(source):
+            exemplars.process(t, **options)
+    return changes(start, exemplars)
+
+
+def _sourceText(source):
+    (kind, path) = source
+    if kind == 'zip':
+        try:
+            from wstools.dbl import DBL
+        except ImportError:
+            from dbl import DBL
+        dblobj = DBL(path)
+        try:
+            for batch in dblobj.analyze_batches():
+                for t in batch:
+                    yield t
+        finally:
+            dblobj.close_project()
+    else:
+        with codecs.open(path, 'r', encoding='utf_8_sig') as inf:
+            for line in inf:
+                yield line
+
+
+class ExemplarAccumulator(object):
+    """Feeds text to an Exemplars, optionally spreading the work across a
+    multiprocessing pool.
+
+    With a pool, text is gathered into shards that workers process into
+    fresh Exemplars configured like this one. Their counting state, the
+    attributes that process() changed, comes back and is merged in the
+    order the text was given: counters are added, sets unioned, lists
+    extended and dicts merged key by key. Merging in order keeps even
+    the order of counter keys the same as serial processing, so analyze()
+    gives the same answers. If a shard changed state that cannot be
+    merged like that, or could not be sent back, it and all the text
+    after it is processed here instead, so the result is always that of
+    processing the text serially.
+
+    Configure the Exemplars before making the accumulator, and call
+    finish() before analyze().
+    """
+
+    def __init__(self, exemplars=None, options=None, pool=None, shardchars=SHARDCHARS, inflight=None):
+        self.exemplars = exemplars if exemplars is not None else Exemplars()
+        self.options = options or {}
+        self.pool = pool
+        self.shardchars = shardchars
+        self.inflight = inflight or 2 * getattr(pool, '_processes', 2)
+        self.template = snapshot(self.exemplars) if pool is not None else None
+        self._shard = []
+        self._shardlen = 0
+        self._pending = deque()
+
+    def process(self, text):
+        self.feed([text])
+
+    def feed(self, texts):
+        """ Process a batch of strings """
+        if self.pool is None:
+            for t in texts:
+                self.exemplars.process(t, **self.options)
+            return
+        self._shard.extend(texts)
+        self._shardlen += sum(map(len, texts))
+        if self._shardlen >= self.shardchars:
+            self._flush()
+
+    def feedSource(self, source):
+        """Process a whole project zip, ('zip', path), or text file, ('file',
+        path), in a worker if there is a pool."""
+        if self.pool is None:
+            for t in _sourceText(source):
+                self.exemplars.process(t, **self.options)
+        else:
+            self._flush()
+            self._submit(source)
+
+    def finish(self):
+        """ Wait for all the shards and return the Exemplars, ready to analyze """
+        if self.pool is not None:
+            self._flush()
+            while len(self._pending):
+                self._collect()
+        return self.exemplars
+
+    def merge(self, state):
+        """Merge the changes a shard made to an Exemplars configured like this
+        one. Raises MergeError, leaving the exemplars untouched, if they
+        cannot be merged exactly."""
+        current = vars(self.exemplars)
+        for k, v in state.items():
+            if k not in self.template or k not in current:
+                raise MergeError("{} is not in the template".format(k))
+            try:
+                _check(current[k], self.template[k], v)
+            except MergeError as e:
+                raise MergeError("{}: {}".format(k, e))
+        for k, v in state.items():
+            setattr(self.exemplars, k, _merge(current[k], self.template[k], v))
+
+    def _flush(self):
+        shard = self._shard
+        self._shard = []
+        self._shardlen = 0
+        if len(shard):
+            self._submit(shard)
+
+    def _submit(self, source):
+        if self.pool is None:
+            # Gone serial after a shard would not merge
+            if isinstance(source, tuple):
+                self.feedSource(source)
+            else:
+                self.feed(source)
+            return
+        self._pending.append((source, self.pool.apply_async(_shard, ((self.template, self.options, source),))))
+        while len(self._pending) > self.inflight:
+            self._collect()
+
+    def _collect(self):
+        (source, res) = self._pending.popleft()
+        try:
+            self.merge(res.get())
+            return
+        except Exception as e:
+            logger.info("Processing exemplars serially, a shard could not be merged: {}".format(e))
+        # Everything from this shard on is processed here, in order
+        pending = [source] + [p[0] for p in self._pending] + [self._shard]
+        self._pending.clear()
+        self._shard = []
+        self._shardlen = 0
+        self.pool = None
+        for s in pending:
+            self._submit(s)
@@ -0,0 +1,150 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+# Concurrent fetching of the files that make up a DBL entry
+
+import asyncio
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+
+class Fetcher(object):
+    """Fetches the files of an entry concurrently through a DBLReader.
+
+    The actual requests are made by reader.getfile() on a long lived
+    thread pool, so each thread keeps its own pooled session and the
+    DBLAuthV1 signing is unchanged. Asyncio keeps at most perentry
+    requests in flight for one entry, and at most perhost requests in
+    flight to any one host across all the entries this process is
+    fetching.
+
+    Bodies are streamed into spool files that only stay in memory up to
+    spoolsize bytes, so memory use does not grow with the file size.
+    """
+
+    def __init__(self, reader, perentry=8, perhost=16, spoolsize=1024*1024):
+        self.reader = reader
+        self.perentry = perentry
+        self.perhost = perhost
+        self.spoolsize = spoolsize
+        self._executor = None
+        self._hostlimits = {}
+        self._lock = threading.Lock()
+
+    def fetchAll(self, baseurl, files, consume, cached=None, opener=None, timings=None):
+        """Fetch baseurl/uri for each file in the files list, calling
+        consume(fileinfo, fileobj, status) in the original file order.
+        fileobj is positioned at the start of the file contents, or is None
+        if the file could not be fetched, and is closed after consume returns.
+        If given, cached(fileinfo) may return an open file to use instead
+        of fetching, and opener(fileinfo) returns a new w+b file to fetch
+        into in place of a spool file. If timings is a dict, it gets the
+        metrics from reader.getfile() for each fetched uri. A ConnectionError
+        from any file cancels the rest and is raised."""
+        if not len(files):
+            return
+        asyncio.run(self._fetchAll(baseurl, files, consume, cached, opener, timings))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def _fetchAll(self, baseurl, files, consume, cached, opener, timings):
+        loop = asyncio.get_running_loop()
+        executor = self._getExecutor()
+        entrylimit = asyncio.Semaphore(self.perentry)
+
+        async def fetchOne(e):
+            if cached is not None:
+                dat = cached(e)
+                if dat is not None:
+                    return (dat, 200)
+            url = "{}/{}".format(baseurl, e['uri'])
+            async with entrylimit:
+                return await loop.run_in_executor(executor, self._fetch, url, e, opener, timings)
+
+        tasks = [asyncio.ensure_future(fetchOne(e)) for e in files]
+        try:
+            for e, t in zip(files, tasks):
+                (dat, result) = await t
+                try:
+                    consume(e, dat, result)
+                finally:
+                    if dat is not None:
+                        dat.close()
+        finally:
+            for t in tasks:
+                t.cancel()
+            for res in await asyncio.gather(*tasks, return_exceptions=True):
+                if isinstance(res, tuple) and res[0] is not None:
+                    res[0].close()
+
+    def _fetch(self, url, fileinfo, opener=None, timings=None):
+        size = fileinfo.get('size', None)
+        if opener is not None:
+            spool = opener(fileinfo)
+        else:
+            spool = tempfile.SpooledTemporaryFile(max_size=self.spoolsize)
+        metrics = {} if timings is not None else None
+        try:
+            with self._hostLimit(url):
+                (count, result) = self.reader.getfile(url, spool, size=int(size) if size is not None else None,
+                                                      metrics=metrics)
+            if timings is not None:
+                timings[fileinfo['uri']] = metrics
+        except BaseException:
+            spool.close()
+            raise
+        if count is None:
+            spool.close()
+            return (None, result)
+        spool.seek(0)
+        return (spool, result)
+
+    def _hostLimit(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            limit = self._hostlimits.get(host, None)
+            if limit is None:
+                limit = threading.BoundedSemaphore(self.perhost)
+                self._hostlimits[host] = limit
+        return limit
+
+    def _getExecutor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.perhost,
+                                                    thread_name_prefix="dblfetch")
+            return self._executor
+
+    # Thread pools and locks do not survive pickling into pool jobs
+    def __getstate__(self):
+        return {'reader': self.reader, 'perentry': self.perentry, 'perhost': self.perhost,
+                'spoolsize': self.spoolsize}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
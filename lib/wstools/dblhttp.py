@@ -0,0 +1,195 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+# HTTP plumbing shared by the DBL readers in dbl.py and newdbl.py
+
+import os
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Size of the pieces a response body is streamed in
+CHUNKSIZE = 64 * 1024
+
+# Responses worth trying again: throttling and transient server trouble
+RETRYSTATUS = (429, 500, 502, 503, 504)
+
+
+class SizeError(IOError):
+    """A streamed response did not match its advertised size."""
+    pass
+
+
+def streamResponse(response, outf, size=None, chunksize=CHUNKSIZE):
+    """Copy a streamed response body to outf in fixed size chunks.
+
+    If size is given the body is checked against it as it arrives, so an
+    oversized body is abandoned as soon as it runs over. Returns the number
+    of bytes written.
+    """
+    count = 0
+    for chunk in response.iter_content(chunk_size=chunksize):
+        count += len(chunk)
+        if size is not None and count > size:
+            raise SizeError("{} is larger than the advertised {} bytes".format(response.url, size))
+        outf.write(chunk)
+    if size is not None and count != size:
+        raise SizeError("{} has {} bytes, expected {}".format(response.url, count, size))
+    return count
+
+
+class SessionPool(object):
+    """Hands out one keep-alive requests.Session per process and thread.
+
+    Sessions keep their connections to the DBL open between requests, so
+    the hundreds of files in an entry share a few TCP+TLS connections.
+    A session is never shared across a fork or between threads.
+    """
+
+    def __init__(self, poolsize=10, keepalive=True):
+        self.poolsize = poolsize
+        self.keepalive = keepalive
+        self._local = threading.local()
+
+    def get(self):
+        """Return the session for the calling process and thread."""
+        session = getattr(self._local, 'session', None)
+        if session is None or self._local.pid != os.getpid():
+            session = self._makeSession()
+            self._local.session = session
+            self._local.pid = os.getpid()
+        return session
+
+    def close(self):
+        """Close the calling thread's session, if it has one."""
+        session = getattr(self._local, 'session', None)
+        if session is not None and self._local.pid == os.getpid():
+            session.close()
+        self._local.session = None
+
+    def _makeSession(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.poolsize, pool_maxsize=self.poolsize)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if not self.keepalive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    # Readers get pickled into multiprocessing jobs, sessions do not travel
+    def __getstate__(self):
+        return {'poolsize': self.poolsize, 'keepalive': self.keepalive}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+class RetryPolicy(object):
+    """How often and how long to wait before retrying a failed request.
+
+    Waits grow exponentially from backoff seconds up to maxbackoff, with
+    full jitter so that workers that failed together do not retry
+    together. A Retry-After header from the server takes precedence.
+    """
+
+    def __init__(self, retries=5, backoff=1.0, maxbackoff=60.0, statuses=RETRYSTATUS):
+        self.retries = retries
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+        self.statuses = statuses
+
+    def delay(self, attempt, response=None):
+        if response is not None:
+            after = response.headers.get('Retry-After', '')
+            if after.isdigit():
+                return min(float(after), self.maxbackoff)
+        return random.uniform(0, min(self.maxbackoff, self.backoff * (2 ** attempt)))
+
+
+class RateLimiter(object):
+    """Token bucket limiting requests per second across the threads of a
+    process. Downloads run on threads, so one limiter given to the reader
+    holds all of its workers to the rate together.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst) if burst is not None else max(1.0, self.rate)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._last = time.monotonic()
+
+    def acquire(self):
+        """Wait until a request may be made."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.:
+                    self._tokens -= 1.
+                    return
+                wait = (1. - self._tokens) / self.rate
+            time.sleep(wait)
+
+    # A copy in another process limits that process on its own
+    def __getstate__(self):
+        return {'rate': self.rate, 'burst': self.burst}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+def get(session, url, headers, retry=None, limiter=None, **kw):
+    """GET url through session, waiting on limiter before every attempt and
+    retrying connection failures and retryable responses as retry says.
+    headers is a function returning the headers, since they are signed
+    with the time and so must be fresh for each attempt. Any other
+    keyword arguments are passed on to session.get. The number of retries
+    made is left in the response's retries attribute."""
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            response = session.get(url, headers=headers(), **kw)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if retry is None or attempt >= retry.retries:
+                raise
+            wait = retry.delay(attempt)
+            logger.debug("Retrying {} in {:.1f}s after {}".format(url, wait, e))
+        else:
+            if retry is None or response.status_code not in retry.statuses or attempt >= retry.retries:
+                response.retries = attempt
+                return response
+            wait = retry.delay(attempt, response)
+            logger.debug("Retrying {} in {:.1f}s after HTTP {}".format(url, wait, response.status_code))
+            response.close()
+        time.sleep(wait)
+        attempt += 1
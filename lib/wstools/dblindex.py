@@ -0,0 +1,171 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+# An index of the members of a DBL project zip
+
+import io
+import mmap
+import zipfile
+import tempfile
+import posixpath
+from shutil import copyfileobj
+
+# Nested zips up to this size are held in memory, bigger ones in a mapped temporary file
+NESTEDMEMORY = 64 * 1024 * 1024
+
+# Member roles by base name or, failing that, by extension
+ROLES_BY_NAME = {'styles.xml': 'stylesheet', 'metadata.xml': 'metadata'}
+ROLES_BY_EXT = {'lds': 'lds', 'ssf': 'ssf', 'ldml': 'ldml'}
+
+
+class ProjectIndex(object):
+    """The members of a project zip, indexed by extension and by role:
+    stylesheet, metadata, lds, ssf or ldml.
+
+    Built once from the namelist when a project is opened. Every lookup
+    returns members in namelist order, so the answers match those of a
+    scan of the namelist.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.members = set(self.names)
+        self.byext = {}
+        self.roles = {}
+        for n in self.names:
+            if n.endswith("/"):
+                continue
+            base = posixpath.basename(n)
+            (stem, dot, ext) = base.rpartition(".")
+            if not dot:
+                continue
+            self.byext.setdefault(ext, []).append(n)
+            role = ROLES_BY_NAME.get(base, ROLES_BY_EXT.get(ext, None))
+            if role is not None:
+                self.roles.setdefault(role, []).append(n)
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def withExt(self, ext):
+        """ Members whose names end in .ext """
+        if "." in ext:
+            return [n for n in self.names if n.endswith("." + ext)]
+        return self.byext.get(ext, [])
+
+    def firstWithExt(self, ext):
+        res = self.withExt(ext)
+        return res[0] if len(res) else None
+
+    def withRole(self, role):
+        """ Members that are the stylesheet, metadata, lds, ssf or ldml """
+        return self.roles.get(role, [])
+
+
+# The project zip last opened by sharedZip in this process
+_shared = {}
+
+
+def sharedZip(zipfilename):
+    """ A ZipFile for zipfilename that stays open for reuse within this process,
+        as when a pool worker is handed one book of a project after another """
+    z = _shared.get(zipfilename, None)
+    if z is None:
+        for old in _shared.values():
+            old.close()
+        _shared.clear()
+        z = _shared[zipfilename] = zipfile.ZipFile(zipfilename, 'r')
+    return z
+
+
+class _MappedFile(io.RawIOBase):
+    """ A read only file object over an mmap, which ZipFile can read from """
+
+    def __init__(self, mapped):
+        self._map = mapped
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        self._map.seek(pos, whence)
+        return self._map.tell()
+
+    def tell(self):
+        return self._map.tell()
+
+    def read(self, n=-1):
+        return self._map.read() if n is None or n < 0 else self._map.read(n)
+
+    def readinto(self, b):
+        data = self._map.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._map.close()
+        super().close()
+
+
+class NestedZip(zipfile.ZipFile):
+    """ A zip read from a buffer that is let go when the zip is closed """
+
+    def __init__(self, buf):
+        self._buf = buf
+        super().__init__(buf, 'r')
+
+    def close(self):
+        super().close()
+        if self._buf is not None:
+            self._buf.close()
+            self._buf = None
+
+
+def openNested(z, name, threshold=NESTEDMEMORY):
+    """Open the member name of ZipFile z, itself a zip, as a ZipFile.
+
+    Reading a zip straight out of a compressed member means every seek
+    restarts the decompression, so the member is unpacked just once: into
+    memory if it is no bigger than threshold, else into a temporary file
+    that is memory mapped. Raises KeyError if there is no such member.
+    """
+    info = z.getinfo(name)
+    if info.file_size <= threshold:
+        return NestedZip(io.BytesIO(z.read(name)))
+    with tempfile.TemporaryFile() as tmp:
+        with z.open(name) as inf:
+            copyfileobj(inf, tmp, 1024 * 1024)
+        tmp.flush()
+        buf = _MappedFile(mmap.mmap(tmp.fileno(), 0, access=mmap.ACCESS_READ))
+    return NestedZip(buf)
@@ -0,0 +1,168 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+# Record of what each DBL project was last built from, for incremental rebuilds
+
+import os
+import json
+import inspect
+import hashlib
+import sqlite3
+
+# Size of the pieces files are hashed in
+CHUNKSIZE = 64 * 1024
+
+
+def fileDigest(path):
+    """ The md5 digest of the file at path, or None if there is no such file """
+    md5 = hashlib.md5()
+    try:
+        with open(path, "rb") as inf:
+            while True:
+                chunk = inf.read(CHUNKSIZE)
+                if not chunk:
+                    break
+                md5.update(chunk)
+    except FileNotFoundError:
+        return None
+    return md5.hexdigest()
+
+
+def codeDigest(*objs):
+    """The digests of the source files defining each module or class, so
+    that rules can cover the library code an output is made by. Duplicate
+    files are only counted once."""
+    paths = []
+    for o in objs:
+        path = inspect.getsourcefile(o) or inspect.getfile(o)
+        if path not in paths:
+            paths.append(path)
+    return [(os.path.basename(p), fileDigest(p)) for p in paths]
+
+
+def rulesDigest(*tables):
+    """A digest of the rule tables, or anything else that can be dumped as
+    json, that the output of every project depends on. Sets are sorted and
+    anything else json cannot take is represented by its repr."""
+    def encode(o):
+        if isinstance(o, (set, frozenset)):
+            return sorted(o)
+        return repr(o)
+    dat = json.dumps(tables, sort_keys=True, default=encode)
+    return hashlib.md5(dat.encode("utf-8")).hexdigest()
+
+
+class BuildManifest(object):
+    """Persistent record of the inputs each project was last built from.
+
+    For each project zip it keeps the zip's digest, the digest of the rule
+    tables it was built with, the file it was built into and that file's
+    digest, and the digests of any other files the build read, a missing
+    file having a digest of None. A project whose inputs all still match
+    and whose output is still there need not be built again.
+
+    Zip digests are kept with the size and modification time they were
+    taken at, so an unchanged zip is not read again to check it.
+    """
+
+    schema = """CREATE TABLE IF NOT EXISTS projects (
+                    zip TEXT PRIMARY KEY,
+                    zipstat TEXT NOT NULL,
+                    zipdigest TEXT NOT NULL,
+                    rules TEXT NOT NULL,
+                    outfile TEXT,
+                    outdigest TEXT,
+                    deps TEXT NOT NULL)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60)
+        with self.db:
+            self.db.execute(self.schema)
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM projects").fetchone()[0]
+
+    def zipDigest(self, zippath):
+        """ The digest of zippath, taken afresh only if it has changed on disk """
+        zipstat = self._stat(zippath)
+        row = self.db.execute("SELECT zipstat, zipdigest FROM projects WHERE zip=?",
+                              (os.path.abspath(zippath),)).fetchone()
+        if row is not None and row[0] == zipstat:
+            return row[1]
+        return fileDigest(zippath)
+
+    def isCurrent(self, zippath, rules):
+        """True if the last build of zippath was from the same zip, rules
+        and other inputs as are there now, and its output is unchanged."""
+        row = self.db.execute("SELECT zipstat, zipdigest, rules, outfile, outdigest, deps FROM projects WHERE zip=?",
+                              (os.path.abspath(zippath),)).fetchone()
+        if row is None or row[2] != rules:
+            return False
+        (zipstat, zipdigest, _, outfile, outdigest, deps) = row
+        if zipstat != self._stat(zippath) and fileDigest(zippath) != zipdigest:
+            return False
+        outnow = None
+        if outfile is not None:
+            outnow = fileDigest(outfile)
+            if outnow is None or outnow != outdigest:
+                return False
+        for (path, digest) in json.loads(deps):
+            now = fileDigest(path)
+            # An SLDR file that is also the output has moved on from what was read
+            if now != digest and (path != outfile or now != outnow):
+                return False
+        return True
+
+    def record(self, zippath, rules, outfile=None, deps=()):
+        """Record that zippath has just been built with rules, into outfile
+        if it produced one, having read the (path, digest) pairs in deps."""
+        zippath = os.path.abspath(zippath)
+        if outfile is not None:
+            outfile = os.path.abspath(outfile)
+        deps = [(os.path.abspath(p), d) for (p, d) in deps]
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO projects VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (zippath, self._stat(zippath), self.zipDigest(zippath), rules, outfile,
+                             fileDigest(outfile) if outfile is not None else None, json.dumps(deps)))
+
+    def forget(self, zippath):
+        """ Drop the record for zippath, so that it is built next time """
+        with self.db:
+            self.db.execute("DELETE FROM projects WHERE zip=?", (os.path.abspath(zippath),))
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        self.close()
+
+    @staticmethod
+    def _stat(path):
+        st = os.stat(path)
+        return "{}:{}".format(st.st_size, st.st_mtime_ns)
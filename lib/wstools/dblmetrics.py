@@ -0,0 +1,179 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+# Timings and counts from a DBL download run, for finding where the time goes
+
+import os
+import json
+import time
+import threading
+
+# Quantiles reported for the per file timings
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def quantile(vals, q):
+    if not len(vals):
+        return 0.
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))]
+
+
+class Telemetry(object):
+    """Collects per entry and per file metrics over a download run.
+
+    Each entry gets an EntryMetrics from entry(), which the downloading
+    thread fills in. report() aggregates them, and write() saves the
+    report as download-metrics.json and, in Prometheus text format, as
+    download-metrics.prom in the download directory.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self._start = time.monotonic()
+        self.elapsed = None
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def entry(self, entryId, langCode):
+        res = EntryMetrics(entryId, langCode)
+        with self._lock:
+            self.entries.append(res)
+        return res
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self._start
+
+    def report(self):
+        elapsed = self.elapsed if self.elapsed is not None else time.monotonic() - self._start
+        files = [f for e in self.entries for f in e.files]
+        fetched = [f for f in files if f['cache'] is None]
+        statuses = {}
+        for f in fetched:
+            statuses[str(f['status'])] = statuses.get(str(f['status']), 0) + 1
+        ttfbs = [f['ttfb'] for f in fetched if f['ttfb'] is not None]
+        transfers = [f['transfer'] for f in fetched if f['transfer'] is not None]
+        netbytes = sum(f['bytes'] for f in fetched)
+        totals = {
+            'entries': len(self.entries),
+            'entries_ok': len([e for e in self.entries if e.status == 'ok']),
+            'files': len(files),
+            'files_fetched': len(fetched),
+            'files_cached': len(files) - len(fetched),
+            'bytes_fetched': netbytes,
+            'bytes_cached': sum(f['bytes'] for f in files if f['cache'] is not None),
+            'retries': sum(f['retries'] for f in fetched),
+            'statuses': statuses,
+            'MB_per_s': netbytes / elapsed / 1e6 if elapsed > 0 else 0.,
+            'ttfb': {str(q): quantile(ttfbs, q) for q in QUANTILES},
+            'transfer': {str(q): quantile(transfers, q) for q in QUANTILES},
+        }
+        return {'started': self.started, 'seconds': elapsed, 'totals': totals,
+                'entries': [e.report() for e in self.entries]}
+
+    def write(self, downloadDir, name="download-metrics"):
+        report = self.report()
+        for ext, text in (('.json', json.dumps(report, indent=1)), ('.prom', prometheus(report, self.entries))):
+            path = os.path.join(downloadDir, name + ext)
+            with open(path + ".tmp", "w") as outf:
+                outf.write(text)
+            os.replace(path + ".tmp", path)
+        return report
+
+
+class EntryMetrics(object):
+    """ What happened fetching one entry. status is ok, failed or pending,
+        and error is why it failed, if that was an exception """
+
+    def __init__(self, entryId, langCode):
+        self.entryId = entryId
+        self.langCode = langCode
+        self.files = []
+        self.status = 'pending'
+        self.error = None
+        self._start = time.monotonic()
+        self.seconds = None
+
+    def file(self, uri, status, nbytes, ttfb=None, transfer=None, retries=0, cache=None):
+        """ Record a file. cache says where it came from if it was not fetched:
+            'blob' for the blob store, 'resumed' for a staged earlier attempt """
+        self.files.append({'uri': uri, 'status': status, 'bytes': nbytes, 'ttfb': ttfb,
+                           'transfer': transfer, 'retries': retries, 'cache': cache})
+
+    def finish(self, ok, error=None):
+        self.seconds = time.monotonic() - self._start
+        self.status = 'ok' if ok else 'failed'
+        if error is not None:
+            self.error = "{}: {}".format(type(error).__name__, error)
+
+    def report(self):
+        fetched = [f for f in self.files if f['cache'] is None]
+        ttfbs = [f['ttfb'] for f in fetched if f['ttfb'] is not None]
+        nbytes = sum(f['bytes'] for f in fetched)
+        seconds = self.seconds or 0.
+        return {'id': self.entryId, 'langCode': self.langCode, 'status': self.status, 'error': self.error,
+                'seconds': seconds, 'files': len(self.files), 'bytes_fetched': nbytes,
+                'bytes_cached': sum(f['bytes'] for f in self.files if f['cache'] is not None),
+                'cache_hits': len(self.files) - len(fetched),
+                'retries': sum(f['retries'] for f in fetched),
+                'MB_per_s': nbytes / seconds / 1e6 if seconds > 0 else 0.,
+                'ttfb_max': max(ttfbs) if len(ttfbs) else 0.,
+                'file_metrics': self.files}
+
+
+def prometheus(report, entries=()):
+    """ A run report in the Prometheus text exposition format """
+    t = report['totals']
+    res = []
+
+    def metric(name, kind, helptext, samples):
+        res.append("# HELP dbl_download_{} {}".format(name, helptext))
+        res.append("# TYPE dbl_download_{} {}".format(name, kind))
+        for labels, value in samples:
+            lstr = ",".join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                            for k, v in labels)
+            res.append("dbl_download_{}{} {}".format(name, "{" + lstr + "}" if lstr else "", value))
+
+    metric("duration_seconds", "gauge", "Wall clock time of the run.", [((), report['seconds'])])
+    metric("entries_total", "counter", "Entries attempted, by outcome.",
+           [((('status', 'ok'),), t['entries_ok']), ((('status', 'failed'),), t['entries'] - t['entries_ok'])])
+    metric("files_total", "counter", "Entry files, by where they came from.",
+           [((('source', 'network'),), t['files_fetched']), ((('source', 'cache'),), t['files_cached'])])
+    metric("bytes_total", "counter", "Entry file bytes, by where they came from.",
+           [((('source', 'network'),), t['bytes_fetched']), ((('source', 'cache'),), t['bytes_cached'])])
+    metric("responses_total", "counter", "File responses by HTTP status.",
+           [((('status', k),), v) for k, v in sorted(t['statuses'].items())])
+    metric("retries_total", "counter", "Retries of file requests.", [((), t['retries'])])
+    for key, helptext in (('ttfb', "Time to the first byte of a file."), ('transfer', "Time to transfer a file body.")):
+        vals = [f[key] for e in entries for f in e.files if f['cache'] is None and f[key] is not None]
+        metric(key + "_seconds", "summary", helptext,
+               [((('quantile', q),), t[key][str(q)]) for q in QUANTILES])
+        res.append("dbl_download_{}_seconds_sum {}".format(key, sum(vals)))
+        res.append("dbl_download_{}_seconds_count {}".format(key, len(vals)))
+    entrylist = report['entries']
+    metric("entry_seconds", "gauge", "Time taken to fetch an entry.",
+           [((('entry', e['id']), ('lang', e['langCode'])), e['seconds']) for e in entrylist])
+    metric("entry_bytes", "gauge", "Bytes fetched for an entry.",
+           [((('entry', e['id']), ('lang', e['langCode'])), e['bytes_fetched']) for e in entrylist])
+    return "\n".join(res) + "\n"
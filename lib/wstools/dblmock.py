@@ -0,0 +1,251 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+# A local stand-in for the DBL API, for testing and benchmarking DBLReader
+
+import os
+import re
+import time
+import json
+import hmac
+import random
+import hashlib
+import zipfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+_fileurl = re.compile(r"^/api/entries/([^/]+)/revisions/latest/license/owner(?:/(.+))?$")
+
+
+class MockLibrary(object):
+    """The entries served by a MockDBL, as entry id -> (catalog record, {uri: contents}).
+
+    contents is either bytes or a (zipfile path, member name) pair, so the
+    library can stand in for a whole local mirror without loading it.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self._digests = {}
+
+    def add(self, entry, files):
+        self.entries[entry['id']] = (entry, files)
+
+    @classmethod
+    def synthetic(cls, count=10, files=20, size=20000, shared=0.2, seed=1):
+        """A library of count text entries, each of files files around size
+        bytes. About a shared fraction of files are identical across entries."""
+        lib = cls()
+        rnd = random.Random(seed)
+        for i in range(count):
+            eid = "{:016x}".format(rnd.getrandbits(64))
+            entry = {'id': eid, 'languageCode': "x{:02d}".format(i % 100), 'idParatextName': "P{}".format(i),
+                     'entrytype': 'text', 'revision': 1, 'nameAbbreviation': "M{}".format(i)}
+            contents = {}
+            for j in range(files):
+                fsize = max(1, int(rnd.expovariate(1. / size)))
+                if rnd.random() < shared:
+                    uri = "release/shared_{}.xml".format(j)
+                    seedbytes = "shared{}".format(j)
+                    fsize = size
+                else:
+                    uri = "release/USX_1/B{:02d}.usx".format(j)
+                    seedbytes = "{}{}".format(eid, j)
+                block = hashlib.sha256(seedbytes.encode("utf-8")).hexdigest().encode("ascii")
+                contents[uri] = (block * (fsize // len(block) + 1))[:fsize]
+            lib.add(entry, contents)
+        return lib
+
+    @classmethod
+    def fromMirror(cls, dirname, limit=None):
+        """A library serving the {lang}_{id}.zip files in dirname."""
+        lib = cls()
+        for f in sorted(os.listdir(dirname))[:limit]:
+            if not f.endswith(".zip") or "_" not in f:
+                continue
+            (lang, eid) = f[:-4].rsplit("_", 1)
+            path = os.path.join(dirname, f)
+            with zipfile.ZipFile(path) as z:
+                files = {n: (path, n) for n in z.namelist() if not n.endswith("/")}
+            lib.add({'id': eid, 'languageCode': lang, 'idParatextName': lang, 'entrytype': 'text',
+                     'revision': 1, 'nameAbbreviation': lang}, files)
+        return lib
+
+    def contents(self, eid, uri):
+        dat = self.entries[eid][1][uri]
+        if isinstance(dat, tuple):
+            with zipfile.ZipFile(dat[0]) as z:
+                return z.read(dat[1])
+        return dat
+
+    def filesList(self, eid):
+        res = []
+        for uri in self.entries[eid][1].keys():
+            if (eid, uri) not in self._digests:
+                dat = self.contents(eid, uri)
+                self._digests[(eid, uri)] = (len(dat), hashlib.md5(dat).hexdigest())
+            (size, digest) = self._digests[(eid, uri)]
+            res.append({'uri': uri, 'size': size, 'checksum': digest})
+        return {'list': res}
+
+
+class MockDBL(object):
+    """Serves a MockLibrary over HTTP the way the DBL API does.
+
+    Requests must carry a valid DBLAuthV1 signature for key1, key2. Each
+    response can be delayed by latency seconds (plus up to jitter more),
+    has its body sent at no more than bandwidth bytes per second, and
+    fails with a 500 or a 429 with probability errors. GET /_mock/stats
+    reports what has been served.
+    """
+
+    def __init__(self, library, key1="mockkey1", key2="mockkey2", latency=0., jitter=0.,
+                 bandwidth=None, errors=0., host="127.0.0.1", port=0, seed=None):
+        self.library = library
+        self.key1 = key1.lower()
+        self.key2 = key2.lower()
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.errors = errors
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.filetimes = []
+        self.bytes = 0
+        self.server = ThreadingHTTPServer((host, port), _handlerFor(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server.server_address[:2])
+
+    def start(self):
+        """Serve in a background thread, returning the base url."""
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {'requests': dict(self.counts), 'bytes': self.bytes, 'filetimes': list(self.filetimes)}
+
+    def count(self, status, nbytes=0, filetime=None):
+        with self.lock:
+            self.counts[str(status)] = self.counts.get(str(status), 0) + 1
+            self.bytes += nbytes
+            if filetime is not None:
+                self.filetimes.append(filetime)
+
+    def checkAuth(self, method, path, headers):
+        auth = headers.get('X-DBL-Authorization', '')
+        fields = dict(x.split("=", 1) for x in auth.split(",") if "=" in x)
+        if fields.get('version') != 'v1' or fields.get('token', '').lower() != self.key1:
+            return False
+        collected = {}
+        for k, v in headers.items():
+            k = k.lower()
+            if k in ('content-type', 'date') or (k.startswith('x-dbl-') and k != 'x-dbl-authorization'):
+                collected[k] = v.strip()
+        collected.setdefault('content-type', '')
+        collected.setdefault('date', '')
+        buf = "%s %s\n" % (method, path.split('?')[0])
+        for k in sorted(collected.keys()):
+            buf += ("%s:%s\n" % (k, collected[k])) if k.startswith('x-dbl-') else ("%s\n" % collected[k])
+        mac = hmac.new(self.key1.encode("utf-8"), None, hashlib.sha1)
+        mac.update(buf.encode("utf-8"))
+        mac.update(self.key2.encode("utf-8"))
+        return hmac.compare_digest(mac.hexdigest().lower(), fields.get('signature', ''))
+
+    def delay(self):
+        return self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.)
+
+    def failure(self):
+        if self.errors and self.random.random() < self.errors:
+            return self.random.choice((429, 500))
+        return None
+
+
+def _handlerFor(mock):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *a):
+            pass
+
+        def do_GET(self):
+            start = time.monotonic()
+            path = self.path.split('?')[0]
+            if path == "/_mock/stats":
+                return self._send(200, json.dumps(mock.stats()).encode("utf-8"), count=False)
+            if not mock.checkAuth("GET", self.path, self.headers):
+                return self._send(401, b'{"error": "bad signature"}')
+            time.sleep(mock.delay())
+            fail = mock.failure()
+            if fail is not None:
+                return self._send(fail, b'{"error": "injected"}', {'Retry-After': '1'} if fail == 429 else None)
+            if path in ("", "/"):
+                return self._send(200, b'{}')
+            if path == "/api/entries":
+                body = {'entries': [e[0] for e in mock.library.entries.values()]}
+                return self._send(200, json.dumps(body).encode("utf-8"))
+            m = _fileurl.match(path)
+            if m is None or m.group(1) not in mock.library.entries:
+                return self._send(404, b'{}')
+            if m.group(2) is None:
+                return self._send(200, json.dumps(mock.library.filesList(m.group(1))).encode("utf-8"))
+            try:
+                dat = mock.library.contents(m.group(1), m.group(2))
+            except KeyError:
+                return self._send(404, b'{}')
+            self._send(200, dat, ctype="application/octet-stream", count=False)
+            mock.count(200, len(dat), time.monotonic() - start)
+
+        def _send(self, status, body, headers=None, ctype="application/json", count=True):
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            if mock.bandwidth:
+                step = max(1024, int(mock.bandwidth / 20))
+                for i in range(0, len(body), step):
+                    self.wfile.write(body[i:i+step])
+                    time.sleep(min(step, len(body) - i) / mock.bandwidth)
+            else:
+                self.wfile.write(body)
+            if count:
+                mock.count(status)
+
+    return Handler
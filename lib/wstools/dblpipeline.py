@@ -0,0 +1,275 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+# Single pass analysis of a DBL project, feeding each registered stage from one read
+
+import io
+import os
+import logging
+from configparser import RawConfigParser
+
+try:
+    from wstools import dbl, newdbl, dblxml
+    from wstools.dblexemplars import ExemplarAccumulator
+except ImportError:
+    import dbl, newdbl, dblxml
+    from dblexemplars import ExemplarAccumulator
+
+from sldr.ldml_exemplars import Exemplars
+
+logger = logging.getLogger(__name__)
+
+# Stage classes by name
+STAGES = {}
+
+
+def register(cls):
+    """ Class decorator adding a Stage to STAGES under its name """
+    STAGES[cls.name] = cls
+    return cls
+
+
+def makeStage(name, **kw):
+    """ A new instance of the stage registered as name """
+    if name not in STAGES:
+        raise ValueError("Unknown stage {}, expected one of {}".format(name, ", ".join(sorted(STAGES))))
+    return STAGES[name](**kw)
+
+
+def openProject(filename, old=False):
+    """ Open a project zip with newdbl.DBL, or with dbl.DBL if old """
+    if old:
+        return dbl.DBL(filename)
+    res = newdbl.DBL()
+    res.open_project(filename)
+    return res
+
+
+class Project(object):
+    """What the stages of a pipeline share about the project being analysed:
+    its zip filename and language code, the open DBL object, whose index
+    and project zip stages may read members from, the pipeline's
+    multiprocessing pool, if any, and the results of the stages that have
+    finished so far."""
+
+    def __init__(self, filename, langCode, dblobj, pool=None):
+        self.filename = filename
+        self.langCode = langCode
+        self.dbl = dblobj
+        self.pool = pool
+        self.results = {}
+
+
+class Stage(object):
+    """One output of a project analysis. A stage is started before the text
+    is read, given each batch of main text if it wantsText, and finished
+    once the text is done, returning its result. A stage with an ext can
+    write its result out as an artifact. Instances hold the state of one
+    project, so make a new one per project."""
+
+    name = None
+    ext = None
+    wantsText = True
+
+    def __init__(self, **kw):
+        self.options = kw
+
+    def start(self, project):
+        pass
+
+    def consume(self, project, batch):
+        pass
+
+    def finish(self, project):
+        return None
+
+    def write(self, result, outf):
+        pass
+
+
+class ExemplarStage(Stage):
+    """A stage whose result comes from an Exemplars fed the project text.
+    Given a pool, the counting is sharded across it."""
+
+    # Keyword arguments to Exemplars.process
+    process = {}
+
+    def start(self, project):
+        self.exemplars = Exemplars()
+        # As in dbl2ldml, treat every character found as main
+        self.exemplars.frequent = 0.0
+        self.accumulator = ExemplarAccumulator(self.exemplars, self.process, pool=project.pool)
+
+    def consume(self, project, batch):
+        self.accumulator.feed(batch)
+
+    def finish(self, project):
+        return self.accumulator.finish()
+
+
+@register
+class ExemplarsStage(ExemplarStage):
+    """ The Exemplars fed with the text, not yet analysed """
+    name = "exemplars"
+
+
+@register
+class ClustersStage(ExemplarStage):
+    """ Exemplars fed the text, analysed when written as a tsv of grapheme clusters and their counts """
+    name = "gclusters"
+    ext = "tsv"
+
+    def write(self, result, outf):
+        result.analyze()
+        clusters = {k.base+k.trailers: v for k, v in result.raw_clusters.items()}
+        outf.write("cluster\tcount\tcasing patterns\n")
+        for k, v in sorted(clusters.items(), key=lambda a: (-a[1], a[0])):
+            # notes if a character only appears in a specific case in the text
+            if k in result.non_casing_chars.keys():
+                outf.write("{}\t{}\t{}\n".format(k, v, result.non_casing_chars[k]))
+            elif k.upper() in result.non_casing_chars.keys():
+                outf.write("{}\t{}\t{}\n".format(k, v, result.non_casing_chars[k.upper()]))
+            else:
+                outf.write("{}\t{}\t\n".format(k, v))
+
+
+@register
+class MultigraphsStage(ExemplarStage):
+    """ Exemplars counting every potential multigraph, written as a tsv of them and their counts """
+    name = "multigraphs"
+    ext = "tsv"
+    process = {'maxmultigraphs': True}
+
+    def write(self, result, outf):
+        multigraphs = {k.base+k.trailers: v for k, v in result.all_potential_multigraphs.items()}
+        outf.write("multigraph\tcount\n")
+        for k, v in sorted(multigraphs.items(), key=lambda a: (-a[1], a[0])):
+            outf.write("{}\t{}\n".format(k, v))
+
+
+@register
+class FontsStage(Stage):
+    """ The fonts named by the project's lds, ssf and ldml files, as {member: [font names]} """
+    name = "fonts"
+    ext = "tsv"
+    wantsText = False
+
+    def finish(self, project):
+        res = {}
+        index = project.dbl.index
+        for ext in ('lds', 'ssf', 'ldml'):
+            for n in index.withExt(ext):
+                try:
+                    with project.dbl.project.open(n) as inf:
+                        fonts = getattr(self, "_" + ext)(inf)
+                except Exception as e:
+                    logger.debug("Unable to read fonts from {} in {}: {}".format(n, project.filename, e))
+                    continue
+                if len(fonts):
+                    res[n] = fonts
+        return res
+
+    def write(self, result, outf):
+        outf.write("file\tfonts\n")
+        for k, v in sorted(result.items()):
+            outf.write("{}\t{}\n".format(k, ", ".join(v)))
+
+    def _lds(self, inf):
+        config = RawConfigParser()
+        config.read_file(io.TextIOWrapper(inf, encoding="utf-8-sig"))
+        if config.has_option('General', 'font'):
+            return [config.get('General', 'font')]
+        return []
+
+    def _ssf(self, inf):
+        font = dblxml.parse(inf).findtext('.//DefaultFont')
+        return [font] if font else []
+
+    def _ldml(self, inf):
+        res = []
+        for e in dblxml.parse(inf).iter():
+            if isinstance(e.tag, str) and e.tag.endswith("}font") and e.get('name'):
+                res.append(e.get('name'))
+        return res
+
+
+class Pipeline(object):
+    """Runs a list of stages over projects, reading and parsing each
+    project's text once, in batches of the given analyze_batches kind,
+    and handing every batch to each stage that wants text. With a
+    multiprocessing pool the books are extracted in parallel, and stages
+    may spread their own work across it too."""
+
+    def __init__(self, stages, by='paragraph', pool=None, old=False):
+        self.stages = stages
+        self.by = by
+        self.pool = pool
+        self.old = old
+
+    def run(self, filename, langCode=None, dblobj=None, ignoreTextErrors=False):
+        """Analyse one project, returning {stage name: result}. An open DBL
+        object may be passed to use instead of opening filename, and is then
+        left open. If ignoreTextErrors, a failure reading the text is logged
+        and the stages finish with the text they were given."""
+        opened = dblobj is None
+        if opened:
+            dblobj = openProject(filename, old=self.old)
+        try:
+            project = Project(filename, langCode, dblobj, pool=self.pool)
+            for s in self.stages:
+                s.start(project)
+            readers = [s for s in self.stages if s.wantsText]
+            if len(readers):
+                try:
+                    for batch in dblobj.analyze_batches(self.by, pool=self.pool):
+                        for s in readers:
+                            s.consume(project, batch)
+                except Exception as e:
+                    if not ignoreTextErrors:
+                        raise
+                    logger.debug("Unable to read the text of {}: {}".format(filename, e))
+            for s in self.stages:
+                project.results[s.name] = s.finish(project)
+        finally:
+            if opened:
+                dblobj.close_project()
+        return project.results
+
+
+def writeArtifacts(stages, results, outdir, tag):
+    """Write the result of each stage that has an ext, to
+    outdir/<stage name>/<first letter of tag>/<tag>.<ext>. Returns the paths
+    written."""
+    res = []
+    for s in stages:
+        if s.ext is None or results.get(s.name, None) is None:
+            continue
+        path = os.path.join(outdir, s.name, tag[0])
+        os.makedirs(path, exist_ok=True)
+        outfile = os.path.join(path, "{}.{}".format(tag.replace("-", "_"), s.ext))
+        with open(outfile, "w", encoding="utf-8") as outf:
+            s.write(results[s.name], outf)
+        res.append(outfile)
+    return res
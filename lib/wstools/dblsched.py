@@ -0,0 +1,169 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+# Scheduling entry downloads by how much there is to fetch
+
+import sys
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+# What a file costs beyond its bytes, as the bytes that could have been
+# transferred in the time a request takes to get going
+PERFILECOST = 32 * 1024
+
+
+def entryCost(files, perfile=PERFILECOST):
+    """ Estimated cost of fetching the records in an entry's files list """
+    return sum(int(f.get('size', None) or 0) for f in files) + perfile * len(files)
+
+
+def entryBytes(files):
+    return sum(int(f.get('size', None) or 0) for f in files)
+
+
+class Progress(object):
+    """Bytes done out of a known total, reported with an ETA.
+
+    A line is written to out at most every interval seconds, overwriting
+    itself on a terminal and logged as it stands otherwise. Call job() to
+    get the progress of one entry, which makes sure the entry accounts for
+    exactly its share of the total however it finishes.
+    """
+
+    def __init__(self, total, jobs=0, out=None, interval=None):
+        self.total = total
+        self.done = 0
+        self.jobs = jobs
+        self.jobsdone = 0
+        self.out = out if out is not None else sys.stderr
+        self.tty = hasattr(self.out, 'isatty') and self.out.isatty()
+        self.interval = interval if interval is not None else (0.5 if self.tty else 10.)
+        self.start = time.monotonic()
+        self._last = 0.
+        self._lock = threading.Lock()
+
+    def job(self, total):
+        return JobProgress(self, total)
+
+    def add(self, nbytes):
+        with self._lock:
+            self.done += nbytes
+            now = time.monotonic()
+            if now - self._last < self.interval:
+                return
+            self._last = now
+        self.report()
+
+    def finishJob(self):
+        with self._lock:
+            self.jobsdone += 1
+
+    def eta(self):
+        """ Seconds until done at the rate so far, or None if unknown """
+        elapsed = time.monotonic() - self.start
+        if self.done <= 0 or elapsed <= 0:
+            return None
+        return max(0., (self.total - self.done) * elapsed / self.done)
+
+    def line(self):
+        eta = self.eta()
+        if eta is None:
+            etastr = "--:--:--"
+        else:
+            eta = int(eta)
+            etastr = "{}:{:02d}:{:02d}".format(eta // 3600, (eta // 60) % 60, eta % 60)
+        pct = 100. * self.done / self.total if self.total else 100.
+        return "Downloaded {:.1f} of {:.1f} MB ({:.0f}%), {} of {} entries, ETA {}".format(
+                    self.done / 1e6, self.total / 1e6, pct, self.jobsdone, self.jobs, etastr)
+
+    def report(self):
+        if self.tty:
+            self.out.write("\r" + self.line())
+            self.out.flush()
+        else:
+            logger.info(self.line())
+
+    def finish(self):
+        self.report()
+        if self.tty:
+            self.out.write("\n")
+            self.out.flush()
+
+
+class JobProgress(object):
+    """ The progress of one entry within a Progress """
+
+    def __init__(self, parent, total):
+        self.parent = parent
+        self.total = total
+        self.done = 0
+
+    def add(self, nbytes):
+        nbytes = min(nbytes, self.total - self.done)
+        if nbytes > 0:
+            self.done += nbytes
+            self.parent.add(nbytes)
+
+    def finish(self):
+        """ Count whatever was skipped or failed as dealt with """
+        self.add(self.total - self.done)
+        self.parent.finishJob()
+
+
+def schedule(jobs, work, workers=4, progress=None, errors=None):
+    """Run work(*args, progress=...) for each (cost, key, bytes, args) in jobs
+    on workers threads, most costly first so that the big entries do not
+    hold up the end of the run. Yields (key, result) as each job finishes.
+    A job that raises an exception is logged and yields a result of None,
+    and the exception is kept in errors[key] if errors is a dict; the other
+    jobs carry on. The workers share the caller's objects; nothing is pickled."""
+    jobs = sorted(jobs, key=lambda j: j[0], reverse=True)
+
+    def run(key, nbytes, args):
+        jp = progress.job(nbytes) if progress is not None else None
+        try:
+            return work(*args, progress=jp)
+        except Exception as e:
+            logger.error("{} failed: {}: {}".format(key, type(e).__name__, e))
+            if errors is not None:
+                errors[key] = e
+            return None
+        finally:
+            if jp is not None:
+                jp.finish()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="dblsched") as executor:
+        futures = {executor.submit(run, j[1], j[2], j[3]): j[1] for j in jobs}
+        try:
+            for f in as_completed(futures):
+                yield (futures[f], f.result())
+        finally:
+            for f in futures:
+                f.cancel()
+    if progress is not None:
+        progress.finish()
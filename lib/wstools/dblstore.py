@@ -0,0 +1,312 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+# Local state kept alongside a mirror of the DBL
+
+import os
+import json
+import hashlib
+import shutil
+import sqlite3
+import tempfile
+from collections import namedtuple
+
+# Size of the pieces blobs are copied in
+CHUNKSIZE = 64 * 1024
+
+# Recorded as the fetched revision of an entry the catalog gives no revision
+NOREVISION = ""
+
+Delta = namedtuple("Delta", ["new", "changed", "removed", "unchanged"])
+
+
+class EntryStore(object):
+    """Persistent record of the DBL entry catalog, keyed by entry id.
+
+    For each entry it keeps the language code the zip is filed under, the
+    latest revision in the catalog, the revision held in the local zip,
+    and the catalog record itself. Lives in entries.db in the download
+    directory.
+    """
+
+    schema = """CREATE TABLE IF NOT EXISTS entries (
+                    id TEXT PRIMARY KEY,
+                    langcode TEXT NOT NULL,
+                    revision TEXT,
+                    fetched TEXT,
+                    entry TEXT NOT NULL)"""
+
+    def __init__(self, downloadDir, fname="entries.db"):
+        self.path = os.path.join(downloadDir, fname)
+        self.db = sqlite3.connect(self.path, timeout=60)
+        with self.db:
+            self.db.execute(self.schema)
+        jsonpath = os.path.join(downloadDir, "entries.json")
+        if len(self) == 0 and os.path.exists(jsonpath):
+            self._importJson(jsonpath, downloadDir)
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def __contains__(self, eid):
+        return self.get(eid) is not None
+
+    def get(self, eid):
+        """Returns (langcode, revision, fetched revision, entry) or None"""
+        row = self.db.execute("SELECT langcode, revision, fetched, entry FROM entries WHERE id=?",
+                              (eid,)).fetchone()
+        if row is None:
+            return None
+        return (row[0], row[1], row[2], json.loads(row[3]))
+
+    def items(self):
+        for row in self.db.execute("SELECT id, langcode, revision, fetched, entry FROM entries ORDER BY id"):
+            yield (row[0], (row[1], row[2], row[3], json.loads(row[4])))
+
+    def update(self, catalog):
+        """Bring the store up to date with catalog, a dict of
+        entry id -> (langcode, entry). Returns a Delta of entry id lists.
+        An entry is changed if its revision or its language code moved.
+        Entries no longer in the catalog are removed from the store."""
+        new, changed, unchanged = [], [], []
+        old = {r[0]: (r[1], r[2]) for r in self.db.execute("SELECT id, langcode, revision FROM entries")}
+        with self.db:
+            for eid, (langcode, entry) in catalog.items():
+                revision = entryRevision(entry)
+                if eid not in old:
+                    new.append(eid)
+                elif old[eid] != (langcode, revision):
+                    changed.append(eid)
+                else:
+                    unchanged.append(eid)
+                self.db.execute("""INSERT INTO entries (id, langcode, revision, entry) VALUES (?, ?, ?, ?)
+                                   ON CONFLICT(id) DO UPDATE SET langcode=excluded.langcode,
+                                        revision=excluded.revision, entry=excluded.entry""",
+                                (eid, langcode, revision, json.dumps(entry)))
+            removed = sorted(set(old.keys()) - set(catalog.keys()))
+            self.db.executemany("DELETE FROM entries WHERE id=?", [(r,) for r in removed])
+        return Delta(new, changed, removed, unchanged)
+
+    def needsFetch(self, eid, zippath):
+        """True if the local zip is missing or holds an older revision. A zip
+        fetched while the entry had no revision stays current until the
+        catalog gives it one."""
+        res = self.get(eid)
+        if res is None or not os.path.exists(zippath):
+            return True
+        return res[2] is None or (res[1] or NOREVISION) != res[2]
+
+    def markFetched(self, eid, revision):
+        with self.db:
+            self.db.execute("UPDATE entries SET fetched=? WHERE id=?",
+                            (revision if revision is not None else NOREVISION, eid))
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        self.close()
+
+    def _importJson(self, jsonpath, downloadDir):
+        """ Seed the store from an old entries.json dump. Zips already on disk
+            are taken to hold the revision recorded in the dump. """
+        with open(jsonpath) as inf:
+            oldEntries = json.load(inf)
+        with self.db:
+            for key, entry in oldEntries.items():
+                langcode = key[:key.rfind("_")]
+                revision = entryRevision(entry)
+                fetched = None
+                if os.path.exists(os.path.join(downloadDir, key + ".zip")):
+                    fetched = revision if revision is not None else NOREVISION
+                self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                                (entry['id'], langcode, revision, fetched, json.dumps(entry)))
+
+
+def entryRevision(entry):
+    """ The revision of a catalog entry as a string, or None if it has none """
+    rev = entry.get('revision', None)
+    return str(rev) if rev is not None else None
+
+
+class BlobStore(object):
+    """Content addressed store of downloaded entry files.
+
+    Files are kept once each, under a key made of their size and md5
+    digest, whichever entries and revisions they came from. A files list
+    record that advertises its md5 checksum can then be served from the
+    store instead of being fetched again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(size, digest):
+        return "{}-{}".format(int(size), digest.lower())
+
+    def keyFor(self, fileinfo):
+        """ The key of a files list record, or None if it carries no checksum """
+        digest = fileDigest(fileinfo)
+        if digest is None or fileinfo.get('size', None) is None:
+            return None
+        return self.key(fileinfo['size'], digest)
+
+    def open(self, key):
+        """ Open the blob for key for reading, or return None if it is not stored """
+        try:
+            return open(self._blobpath(key), "rb")
+        except FileNotFoundError:
+            return None
+
+    def __contains__(self, key):
+        return os.path.exists(self._blobpath(key))
+
+    def add(self, fileobj):
+        """ Copy fileobj into the store and return its key """
+        md5 = hashlib.md5()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=self.path, delete=False) as outf:
+            try:
+                while True:
+                    chunk = fileobj.read(CHUNKSIZE)
+                    if not chunk:
+                        break
+                    md5.update(chunk)
+                    size += len(chunk)
+                    outf.write(chunk)
+                outf.flush()
+                os.fsync(outf.fileno())
+            except BaseException:
+                outf.close()
+                os.unlink(outf.name)
+                raise
+        key = self.key(size, md5.hexdigest())
+        blobpath = self._blobpath(key)
+        os.makedirs(os.path.dirname(blobpath), exist_ok=True)
+        os.replace(outf.name, blobpath)
+        return key
+
+    def _blobpath(self, key):
+        digest = key[key.index("-")+1:]
+        return os.path.join(self.path, digest[:2], key)
+
+
+class StagedEntry(object):
+    """The files of an entry download that have been fetched so far.
+
+    Each completed file is kept in a staging directory under
+    .partial/<name> in the download directory, or in the blob store, and
+    recorded in a log that is synced to disk as it is written. A download
+    that is interrupted, however that happens, resumes from the last
+    completed file. The log is dropped if the entry revision changes.
+    """
+
+    def __init__(self, downloadDir, name, revision=None):
+        self.path = os.path.join(downloadDir, ".partial", name)
+        self.logpath = os.path.join(self.path, "done.log")
+        self.done = {}
+        os.makedirs(self.path, exist_ok=True)
+        if not self._load(revision):
+            self.clear()
+            self.log = open(self.logpath, "w")
+            self._write({'revision': revision})
+        else:
+            self.log = open(self.logpath, "a")
+
+    def get(self, fileinfo):
+        """ The record of a completed file matching a files list record, or None """
+        rec = self.done.get(fileinfo['uri'], None)
+        if rec is None or (fileinfo.get('size', None) is not None and int(fileinfo['size']) != rec['size']):
+            return None
+        return rec
+
+    def open(self, rec, blobs=None):
+        if 'blob' in rec:
+            return blobs.open(rec['blob']) if blobs is not None else None
+        try:
+            return open(os.path.join(self.path, rec['file']), "rb")
+        except FileNotFoundError:
+            return None
+
+    def filename(self, uri):
+        """ Where to stage the contents of uri """
+        return os.path.join(self.path, hashlib.md5(uri.encode("utf-8")).hexdigest())
+
+    def add(self, uri, size, blob=None):
+        """ Record that uri has been fetched, to the blob store if blob is given """
+        rec = {'uri': uri, 'size': size}
+        if blob is not None:
+            rec['blob'] = blob
+        else:
+            rec['file'] = os.path.basename(self.filename(uri))
+        self._write(rec)
+        self.done[uri] = rec
+
+    def clear(self):
+        for f in os.listdir(self.path):
+            os.unlink(os.path.join(self.path, f))
+        self.done = {}
+
+    def close(self):
+        self.log.close()
+
+    def remove(self):
+        """ Throw away the staged files once the entry has been published """
+        self.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _load(self, revision):
+        if not os.path.exists(self.logpath):
+            return False
+        with open(self.logpath) as inf:
+            for i, l in enumerate(inf):
+                try:
+                    rec = json.loads(l)
+                except ValueError:
+                    break   # a line cut short by the crash
+                if i == 0:
+                    if rec.get('revision', None) != revision:
+                        return False
+                else:
+                    self.done[rec['uri']] = rec
+        return True
+
+    def _write(self, rec):
+        self.log.write(json.dumps(rec) + "\n")
+        self.log.flush()
+        os.fsync(self.log.fileno())
+
+
+def fileDigest(fileinfo):
+    """ The md5 checksum advertised by a files list record, if any """
+    for k in ('md5', 'checksum'):
+        digest = fileinfo.get(k, None)
+        if digest is not None and len(digest) == 32:
+            return digest.lower()
+    return None
@@ -0,0 +1,138 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+# Result records for DBL projects processed in a run, and the summary of the run
+
+import sys
+from functools import partial
+from collections import namedtuple
+
+# What became of one project. status is one of STATUSES, outfile is the
+# file it was written to, newfile is true if that file is new to the SLDR,
+# issues are messages needing manual review and error is why it failed.
+# deps are (path, digest) pairs for the files other than the project that were read.
+ProjectResult = namedtuple("ProjectResult", ["dblfile", "status", "outfile", "newfile", "issues", "error", "deps"],
+                           defaults=(None, False, (), None, ()))
+
+STATUSES = ("done", "skipped", "uptodate", "error")
+
+
+class RunSummary(object):
+    """Collects the ProjectResults of a run as they arrive, in whatever
+    order, keeping just what the end of run report needs.
+
+    Output files are mapped to the projects that wrote them, so projects
+    that overwrite each other are found as each result is added. If
+    progress is a file, a line is written to it for each result.
+    """
+
+    def __init__(self, total=None, progress=None):
+        self.total = total
+        self.progress = progress
+        self.count = 0
+        self.counts = dict.fromkeys(STATUSES, 0)
+        self.outputs = {}
+        self.duplicates = set()
+        self.newfiles = {}
+        self.issues = {}
+        self.errors = {}
+
+    def add(self, res):
+        if res is None:
+            return
+        self.count += 1
+        self.counts[res.status] = self.counts.get(res.status, 0) + 1
+        if res.status == "done" and res.outfile is not None:
+            dblfiles = self.outputs.setdefault(res.outfile, [])
+            dblfiles.append(res.dblfile)
+            if len(dblfiles) > 1:
+                self.duplicates.add(res.outfile)
+            if res.newfile:
+                self.newfiles[res.outfile] = res.dblfile
+            if len(res.issues):
+                self.issues[res.outfile] = [res.dblfile] + list(res.issues)
+        elif res.status == "error":
+            self.errors[res.dblfile] = res.error
+        if self.progress is not None:
+            self._showProgress(res)
+
+    def _showProgress(self, res):
+        total = "/{}".format(self.total) if self.total is not None else ""
+        msg = "[{}{}] {} {}".format(self.count, total, res.status, res.dblfile)
+        if self.progress.isatty():
+            self.progress.write("\r\033[K" + msg)
+            if self.total is not None and self.count >= self.total:
+                self.progress.write("\n")
+        else:
+            self.progress.write(msg + "\n")
+        self.progress.flush()
+
+    def report(self, outf=sys.stdout, newfiles=True, duplicates=None, issues=None):
+        """Print the end of run summary. newfiles says whether to list the
+        files that are new to the SLDR, duplicates and issues are the
+        headings for the projects that wrote the same file and the files
+        with issues."""
+        if newfiles:
+            if len(self.newfiles):
+                outf.write("LDML files generated that don't currently exist in the SLDR, with their respective DBL project file:\n")
+                for n in sorted(self.newfiles.items()):
+                    outf.write("\t" + str(n) + "\n")
+            else:
+                outf.write("No new LDML files generated from this batch of DBL files\n")
+        if len(self.duplicates):
+            outf.write((duplicates or "Multiple DBL files saved to the same path, therefore overriding one or more of them:") + "\n")
+            for o in sorted(self.duplicates):
+                for d in self.outputs[o]:
+                    outf.write("\t" + str((d, o)) + "\n")
+        if len(self.issues):
+            outf.write((issues or "Issues with some files listed below:") + "\n")
+            for i in sorted(self.issues.items()):
+                outf.write("\t" + str(i) + "\n")
+        if len(self.errors):
+            outf.write("Errors processing these DBL files:\n")
+            for e in sorted(self.errors.items()):
+                outf.write("\t" + str(e) + "\n")
+        outf.write(", ".join("{} {}".format(v, k) for k, v in self.counts.items() if v) + "\n")
+        outf.write("ALL DONE!\n")
+
+
+def _withJob(func, job):
+    return (job, func(job))
+
+
+def runJobs(func, jobs, pool=None, summary=None, record=None):
+    """Call func on each of jobs, in pool if given, adding the
+    ProjectResult each returns to summary as soon as it is done. The
+    results from a pool come back in the order they finish. If given,
+    record(job, result) is also called for each, in this process."""
+    if summary is None:
+        summary = RunSummary(total=len(jobs))
+    call = partial(_withJob, func)
+    results = pool.imap_unordered(call, jobs) if pool is not None else map(call, jobs)
+    for (job, res) in results:
+        summary.add(res)
+        if record is not None:
+            record(job, res)
+    return summary
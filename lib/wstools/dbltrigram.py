@@ -0,0 +1,300 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+# A persistent trigram index over the members of the zips in a DBL mirror
+
+import os
+import re
+import html
+import zlib
+import codecs
+import sqlite3
+import zipfile
+from array import array
+from bisect import bisect_left
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+try:
+    from wstools.dblindex import openNested
+except ImportError:
+    from dblindex import openNested
+
+# Members bigger than this are not indexed, and so always searched
+MAXINDEXED = 32 * 1024 * 1024
+
+# Nor are members with more distinct trigrams than this, which are not text
+MAXGRAMS = 1 << 18
+
+# Nor members with these extensions
+BINARYEXTS = ('.png', '.jpg', '.jpeg', '.gif', '.tif', '.tiff', '.bmp', '.pdf', '.ttf', '.otf',
+              '.woff', '.woff2', '.mp3', '.mp4', '.wav', '.zip', '.gz', '.exe', '.dll')
+
+# Repeats that require their contents to match at least once
+_repeats = ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+
+
+def textGrams(data):
+    """The sorted distinct trigrams of a member's contents, as 24 bit ints
+    of UTF-8 bytes, or None if it has too many to be worth indexing. XML
+    escapes are indexed both as they are and unescaped, so that both the
+    raw bytes and the parsed text of the member are covered."""
+    if data.startswith(codecs.BOM_UTF16_LE) or data.startswith(codecs.BOM_UTF16_BE):
+        data = data.decode("utf-16", "replace").encode("utf-8")
+    # Byte tuples are the quickest to collect, ints are made from the distinct ones
+    grams = set(zip(data, data[1:], data[2:]))
+    if b"&" in data:
+        unescaped = html.unescape(data.decode("utf-8", "replace")).encode("utf-8")
+        grams.update(zip(unescaped, unescaped[1:], unescaped[2:]))
+    if len(grams) > MAXGRAMS:
+        return None
+    return array('I', sorted((a << 16) | (b << 8) | c for (a, b, c) in grams))
+
+
+def stringGrams(s):
+    """ The trigrams a member must hold to contain the string s """
+    b = s.encode("utf-8")
+    return frozenset(int.from_bytes(b[i:i+3], "big") for i in range(len(b) - 2))
+
+
+def regexQuery(pattern, flags=0):
+    """Work out which trigrams any text matching pattern must contain. The
+    query is either a frozenset of trigrams that must all be present, or
+    ('and', [queries]) or ('or', [queries]). Returns None if the pattern
+    does not constrain the trigrams at all, and so needs a full scan."""
+    parsed = sre_parse.parse(pattern, flags)
+    res = _sequence(list(parsed), parsed.state.flags)
+    return None if res == _ALL else res
+
+
+_ALL = frozenset()
+
+
+def _and(queries):
+    queries = [q for q in queries if q != _ALL]
+    grams = frozenset().union(*[q for q in queries if isinstance(q, frozenset)])
+    rest = [q for q in queries if not isinstance(q, frozenset)]
+    if not len(rest):
+        return grams
+    if not len(grams) and len(rest) == 1:
+        return rest[0]
+    return ('and', ([grams] if len(grams) else []) + rest)
+
+
+def _or(queries):
+    if _ALL in queries:
+        return _ALL
+    return queries[0] if len(queries) == 1 else ('or', queries)
+
+
+def _sequence(items, flags):
+    if flags & re.IGNORECASE:
+        return _ALL
+    res = []
+    run = []
+    for (op, av) in items + [(None, None)]:
+        name = str(op)
+        if name == 'LITERAL':
+            run.append(chr(av))
+            continue
+        if len(run):
+            res.append(stringGrams("".join(run)))
+            run = []
+        if name == 'SUBPATTERN':
+            res.append(_sequence(list(av[-1]), (flags | av[1]) & ~av[2]))
+        elif name == 'ATOMIC_GROUP':
+            res.append(_sequence(list(av), flags))
+        elif name == 'BRANCH':
+            res.append(_or([_sequence(list(b), flags) for b in av[1]]))
+        elif name in _repeats and av[0] > 0:
+            res.append(_sequence(list(av[2]), flags))
+    return _and(res)
+
+
+def _has(grams, g):
+    i = bisect_left(grams, g)
+    return i < len(grams) and grams[i] == g
+
+
+def matches(query, grams):
+    """ Could a member with these sorted trigrams satisfy the query? """
+    if grams is None:
+        return True
+    if isinstance(query, frozenset):
+        return all(_has(grams, g) for g in query)
+    if query[0] == 'and':
+        return all(matches(q, grams) for q in query[1])
+    return any(matches(q, grams) for q in query[1])
+
+
+def _pack(grams):
+    return zlib.compress(grams.tobytes()) if grams is not None else None
+
+
+def _unpack(blob):
+    if blob is None:
+        return None
+    res = array('I')
+    res.frombytes(zlib.decompress(blob))
+    return res
+
+
+def _memberGrams(z, info):
+    if info.file_size > MAXINDEXED or info.filename.lower().endswith(BINARYEXTS):
+        return None
+    return textGrams(z.read(info))
+
+
+def indexZip(path):
+    """Index one zip, and the source/source.zip inside it. Returns what
+    TrigramIndex.update stores: (path, size, mtime, [(source, name, grams)])."""
+    st = os.stat(path)
+    members = []
+    with zipfile.ZipFile(path) as z:
+        for info in z.infolist():
+            if info.is_dir():
+                continue
+            if info.filename == "source/source.zip":
+                try:
+                    with openNested(z, info.filename) as zs:
+                        for sinfo in zs.infolist():
+                            if not sinfo.is_dir():
+                                members.append((1, sinfo.filename, _pack(_memberGrams(zs, sinfo))))
+                except zipfile.BadZipFile:
+                    pass
+            else:
+                members.append((0, info.filename, _pack(_memberGrams(z, info))))
+    return (path, st.st_size, st.st_mtime_ns, members)
+
+
+class TrigramIndex(object):
+    """Trigrams of the members of the zips of a DBL mirror, kept in sqlite.
+
+    Each member, including those of a zip's source/source.zip, has its
+    distinct trigrams stored as a compressed sorted array, and each zip has
+    the union of its members' trigrams. A regex query then rules out whole
+    zips, and members within the rest, that cannot contain a match, and
+    only the candidates need be read and searched. Zips are reindexed when
+    their size or mtime changes. Members that are not indexed are always
+    candidates.
+    """
+
+    schema = ("""CREATE TABLE IF NOT EXISTS zips (
+                    id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, size INTEGER, mtime INTEGER,
+                    unindexed INTEGER, grams BLOB)""",
+              """CREATE TABLE IF NOT EXISTS members (
+                    zip INTEGER NOT NULL, source INTEGER NOT NULL, name TEXT NOT NULL, grams BLOB)""",
+              "CREATE INDEX IF NOT EXISTS members_zip ON members (zip)")
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60)
+        with self.db:
+            for s in self.schema:
+                self.db.execute(s)
+
+    def stale(self, paths):
+        """ Those of paths that are not indexed or have changed since they were """
+        known = {r[0]: (r[1], r[2]) for r in self.db.execute("SELECT path, size, mtime FROM zips")}
+        res = []
+        for p in paths:
+            st = os.stat(p)
+            if known.get(os.path.abspath(p), None) != (st.st_size, st.st_mtime_ns):
+                res.append(p)
+        return res
+
+    def update(self, paths, pool=None, prune=True):
+        """Bring the index up to date for paths, indexing across pool if
+        given. If prune, zips that no longer exist are dropped. Returns the
+        number of zips (re)indexed."""
+        stale = [os.path.abspath(p) for p in self.stale(paths)]
+        results = pool.imap_unordered(indexZip, stale) if pool is not None else map(indexZip, stale)
+        count = 0
+        for (path, size, mtime, members) in results:
+            self._store(path, size, mtime, members)
+            count += 1
+        if prune:
+            gone = [r[0] for r in self.db.execute("SELECT path FROM zips") if not os.path.exists(r[0])]
+            for p in gone:
+                self._remove(p)
+        return count
+
+    def candidates(self, query, paths):
+        """Returns {path: candidate members} for those of paths that could
+        hold a match for query. Candidate members are (source, name) pairs,
+        source being 1 for members of source/source.zip. A path that is not
+        indexed maps to None, meaning all its members."""
+        res = {}
+        for p in paths:
+            row = self.db.execute("SELECT id, unindexed, grams FROM zips WHERE path=?",
+                                  (os.path.abspath(p),)).fetchone()
+            if row is None:
+                res[p] = None
+                continue
+            if not row[1] and not matches(query, _unpack(row[2])):
+                continue
+            members = set()
+            for (source, name, blob) in self.db.execute("SELECT source, name, grams FROM members WHERE zip=?",
+                                                        (row[0],)):
+                if matches(query, _unpack(blob)):
+                    members.add((source, name))
+            if len(members):
+                res[p] = members
+        return res
+
+    def _store(self, path, size, mtime, members):
+        union = set()
+        unindexed = 0
+        for m in members:
+            grams = _unpack(m[2])
+            if grams is None:
+                unindexed += 1
+            else:
+                union.update(grams)
+        with self.db:
+            self._remove(path)
+            cur = self.db.execute("INSERT INTO zips (path, size, mtime, unindexed, grams) VALUES (?, ?, ?, ?, ?)",
+                                  (path, size, mtime, unindexed, _pack(array('I', sorted(union)))))
+            self.db.executemany("INSERT INTO members VALUES (?, ?, ?, ?)",
+                                [(cur.lastrowid,) + m for m in members])
+
+    def _remove(self, path):
+        with self.db:
+            row = self.db.execute("SELECT id FROM zips WHERE path=?", (path,)).fetchone()
+            if row is not None:
+                self.db.execute("DELETE FROM members WHERE zip=?", (row[0],))
+                self.db.execute("DELETE FROM zips WHERE id=?", (row[0],))
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        self.close()
@@ -0,0 +1,94 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+# Streaming access to the paragraphs of a USX book, and the styles to take text from
+
+import io
+import hashlib
+try:
+    from wstools.dblxml import iterparse, parse as parsexml
+except ImportError:
+    from dblxml import iterparse, parse as parsexml
+
+# Stylesheet ids in Arabic, as some stylesheets have them (arq), and the USFM ids they stand for
+ARABIC_STYLE_IDS = {'ك':'id', 'عك':'h', 'م':'imt', 'مف':'ip', 'ص':'c', 'ي':'v', 'ف':'p', 'ف 1':'m', 'ف 2':'nb',
+                    'ش':'q', 'ش1':'q1', 'ش2':'q2', 'س':'qs', 'شغ':'b', 'عر':'mt', 'عر1':'mt1', 'عر2':'mt2',
+                    'عق':'ms', 'عق1':'mr', 'ع':'s', 'ع1':'s1', 'ع2':'s2', 'عش':'r', 'عم':'sp', 'عج':'d',
+                    'ت':'f', 'تش':'fr', 'تن':'ft', 'تنش':'fq', 'تشم':'x', 'تشل':'xo', 'تشت':'xt', 'صو':'fig'}
+
+# Compiled stylesheets by digest and rules. Most projects share a few stock stylesheets.
+_compiled = {}
+MAXCOMPILED = 1024
+
+
+def iterParagraphs(usx):
+    """Yield each top level element (book, chapter, para...) of a USX file
+    as soon as it and its tail have been parsed. Once the caller moves on
+    the element is cleared and dropped from the root, so no more than one
+    paragraph of the book is held in memory at a time."""
+    root = None
+    depth = 0
+    pending = None
+    for event, elem in iterparse(usx, events=('start', 'end')):
+        # The tail of a paragraph is only complete once the next event arrives
+        if pending is not None:
+            yield pending
+            pending.clear()
+            root.remove(pending)
+            pending = None
+        if event == 'start':
+            depth += 1
+            if root is None:
+                root = elem
+        else:
+            depth -= 1
+            if depth == 1:
+                pending = elem
+
+
+def compileStylesheet(style, main_text, also=(), remap=None):
+    """Read a styles.xml file object and return (publishable, accepted),
+    frozensets of the publishable style ids and of the paragraph styles
+    whose text is wanted. A style is accepted if it is publishable, after
+    renaming through remap, and either starts with one of the main_text
+    prefixes or is in also. Results are cached by the stylesheet digest."""
+    data = style.read()
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    digest = hashlib.sha1(data).hexdigest()
+    key = (digest, tuple(main_text), tuple(also), tuple(sorted(remap.items())) if remap else None)
+    res = _compiled.get(key, None)
+    if res is not None:
+        return res
+    publishable = _compiled.get(digest, None)
+    if publishable is None:
+        tree = parsexml(io.BytesIO(data))
+        publishable = frozenset(m.get('id') for m in tree.findall('style') if m.get('publishable') == 'true')
+    renamed = (remap.get(s, s) for s in publishable) if remap else publishable
+    accepted = frozenset(s for s in renamed if s is not None and (s.startswith(main_text) or s in also))
+    if len(_compiled) >= MAXCOMPILED:
+        _compiled.clear()
+    _compiled[digest] = publishable
+    res = _compiled[key] = (publishable, accepted)
+    return res
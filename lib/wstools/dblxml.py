@@ -0,0 +1,113 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+# XML parsing through lxml when it is installed, else the standard library
+#
+# Set WSTOOLS_XML=stdlib in the environment, or call useBackend("stdlib"),
+# to keep to xml.etree.ElementTree even when lxml is there.
+
+import io
+import os
+import xml.etree.ElementTree as stdET
+
+try:
+    from lxml import etree as lxmlET
+except ImportError:
+    lxmlET = None
+
+ET = None
+backend = None
+
+
+def useBackend(name=None):
+    """ Switch to the "lxml" or "stdlib" backend, or the best available if None """
+    global ET, backend
+    if name is None:
+        name = "lxml" if lxmlET is not None and os.getenv("WSTOOLS_XML", "") != "stdlib" else "stdlib"
+    if name == "lxml":
+        if lxmlET is None:
+            raise ImportError("lxml is not installed")
+        ET = lxmlET
+    elif name == "stdlib":
+        ET = stdET
+    else:
+        raise ValueError("Unknown XML backend {}".format(name))
+    backend = name
+    return backend
+
+useBackend()
+
+
+def _lxmlSource(source):
+    """ lxml only reads bytes. The binary file under a text file will do,
+        otherwise None says to leave it to the standard library. """
+    if isinstance(source, io.TextIOBase):
+        return getattr(source, 'buffer', None)
+    return source
+
+
+def parse(source):
+    """ Parse a file name or file object into an ElementTree """
+    if backend == "lxml":
+        src = _lxmlSource(source)
+        if src is not None:
+            return lxmlET.parse(src, lxmlET.XMLParser(remove_comments=True, remove_pis=True))
+    return stdET.parse(source)
+
+
+def iterparse(source, events=('end',)):
+    """ Incrementally parse source yielding (event, element) pairs. Comments and
+        processing instructions are left out of the tree, as the standard
+        library does. """
+    if backend == "lxml":
+        src = _lxmlSource(source)
+        if src is not None:
+            return lxmlET.iterparse(src, events=events, remove_comments=True, remove_pis=True)
+    return stdET.iterparse(source, events=events)
+
+
+def compilePath(path):
+    """Compile an xpath into a function of an element or tree returning the
+    text of each match. With lxml this is a compiled XPath, which also
+    allows full XPath such as text() and functions. The standard library
+    takes the ElementPath subset through findall."""
+    if backend == "lxml":
+        try:
+            xp = lxmlET.XPath(path)
+        except lxmlET.XPathSyntaxError:
+            pass
+        else:
+            def lxmlTexts(node):
+                # Paths are relative to the root element, as with findall on a tree
+                if hasattr(node, 'getroot'):
+                    node = node.getroot()
+                res = xp(node)
+                if not isinstance(res, list):
+                    return [str(res)]
+                return [r.text if hasattr(r, 'tag') else str(r) for r in res]
+            return lxmlTexts
+
+    def stdTexts(node):
+        return [e.text for e in node.findall(path)]
+    return stdTexts
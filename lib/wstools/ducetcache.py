@@ -0,0 +1,106 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+# A pickled copy of the DUCET table, loaded at most once per process
+
+import os
+import sys
+import pickle
+import hashlib
+import logging
+import tempfile
+
+from sldr import ducet as _ducet
+
+logger = logging.getLogger(__name__)
+
+# Bump this if what is cached changes shape
+CACHEVERSION = 1
+
+# The table this process has loaded
+_table = None
+
+
+def cacheKey():
+    """A key that changes whenever the sldr ducet module or the data files
+    alongside it do, or the pickle format or python version moves."""
+    h = hashlib.sha1("{}:{}:{}".format(CACHEVERSION, pickle.HIGHEST_PROTOCOL, sys.version).encode("utf-8"))
+    moddir = os.path.dirname(os.path.abspath(_ducet.__file__))
+    for f in sorted(os.listdir(moddir)):
+        if f.startswith("ducet") or "allkeys" in f.lower():
+            st = os.stat(os.path.join(moddir, f))
+            h.update("{}:{}:{}".format(f, st.st_size, st.st_mtime_ns).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def cacheDir():
+    """ $WSTOOLS_DUCETCACHE, else wstools/ducet in the user's cache directory """
+    path = os.getenv("WSTOOLS_DUCETCACHE", None)
+    if path is None:
+        base = os.getenv("XDG_CACHE_HOME", None) or os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, "wstools", "ducet")
+    return path
+
+
+def loadDucet(cachedir=None):
+    """Return the DUCET table from the cache, reading it with
+    sldr.ducet.readDucet and caching it if the cache is missing or stale.
+    An unusable cache directory just means reading it every time."""
+    path = os.path.join(cachedir or cacheDir(), "ducet-{}.pickle".format(cacheKey()))
+    try:
+        with open(path, "rb") as inf:
+            return pickle.load(inf)
+    except FileNotFoundError:
+        pass
+    except (OSError, pickle.UnpicklingError, EOFError) as e:
+        logger.info("Ignoring unreadable DUCET cache {}: {}".format(path, e))
+    table = _ducet.readDucet()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        (fd, tmppath) = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as outf:
+                pickle.dump(table, outf, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmppath, path)
+        except BaseException:
+            os.unlink(tmppath)
+            raise
+    except (OSError, pickle.PicklingError) as e:
+        logger.info("Unable to cache DUCET in {}: {}".format(path, e))
+    return table
+
+
+def ducet():
+    """ The DUCET table, loaded once per process """
+    global _table
+    if _table is None:
+        _table = loadDucet()
+    return _table
+
+
+def initWorker():
+    """Pool initializer loading the DUCET table. Workers forked after the
+    parent has called ducet() already share its copy."""
+    ducet()
@@ -31,15 +31,52 @@ import requests, hmac, hashlib, json
 # import codecs
 import zipfile, logging
 import xml.etree.ElementTree as ET
-from shutil import copyfile
+from shutil import copyfile, copyfileobj
 from datetime import datetime
 import time
+import glob
+from concurrent.futures import ThreadPoolExecutor
 from time import mktime
 from zipfile import ZipFile
 import logging
 
 logger = logging.getLogger(__name__)
 
+try:
+    from wstools.dblhttp import SessionPool, RetryPolicy, RateLimiter, get as httpget, SizeError, streamResponse, CHUNKSIZE
+except ImportError:
+    from dblhttp import SessionPool, RetryPolicy, RateLimiter, get as httpget, SizeError, streamResponse, CHUNKSIZE
+
+try:
+    from wstools.dblfetch import Fetcher
+except ImportError:
+    from dblfetch import Fetcher
+
+try:
+    from wstools.dblstore import EntryStore, BlobStore, StagedEntry, entryRevision
+except ImportError:
+    from dblstore import EntryStore, BlobStore, StagedEntry, entryRevision
+try:
+    from wstools.dblsched import Progress, schedule, entryCost, entryBytes
+except ImportError:
+    from dblsched import Progress, schedule, entryCost, entryBytes
+try:
+    from wstools.dblindex import ProjectIndex, sharedZip, openNested
+except ImportError:
+    from dblindex import ProjectIndex, sharedZip, openNested
+try:
+    from wstools.dblcorpus import defaultTextCache
+except ImportError:
+    from dblcorpus import defaultTextCache
+try:
+    from wstools.dblusx import iterParagraphs, compileStylesheet
+except ImportError:
+    from dblusx import iterParagraphs, compileStylesheet
+try:
+    from wstools.dblmetrics import Telemetry
+except ImportError:
+    from dblmetrics import Telemetry
+
 dblurl = "https://api.thedigitalbiblelibrary.org"
 try:
     from sldr.ldml_exemplars import Exemplars
@@ -161,24 +198,40 @@ class DBLAuthV1(requests.auth.AuthBase):
                 buf += "%s\n" % val
         return buf
 
-def doone(a):
-    a[0].downloadOneEntry(*a[1:])
-
 class DBLReader(object):
-    def __init__(self, key1 = None, key2 = None):
+    def __init__(self, key1 = None, key2 = None, poolsize=10, keepalive=True, retry=None, limiter=None, perentry=8, perhost=None, blobdir=None, baseurl=None):
         if key1 is None or key2 is None:
             key1, key2 = getdblkeys()
         self.secretKey = key2
         self.auth = DBLAuthV1(key1, key2)
-
-    def download(self, downloadDir, lang=None, skiplangs=['en', 'eng'], nozips=False, mapfile=None, pool=None, owned=True):
-        entryfpath = os.path.join(downloadDir, "entries.json")
-        if lang is None and os.path.exists(entryfpath):
-            with open(entryfpath) as inf:
-                outEntries = json.load(inf)
-        else:
-            outEntries = {}
-        entries, httpResult = self.getjson(dblurl+'/api/entries') # + ('' if owned else '/visible_entries'))
+        self.baseurl = baseurl or dblurl
+        self.sessions = SessionPool(poolsize=poolsize, keepalive=keepalive)
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.limiter = limiter
+        self.fetcher = Fetcher(self, perentry=perentry, perhost=perhost or poolsize)
+        self.blobs = BlobStore(blobdir) if blobdir is not None else None
+
+    @property
+    def session(self):
+        """ The pooled keep-alive session for this process and thread """
+        return self.sessions.get()
+
+    def _get(self, url, headers, **kw):
+        """ Signed GET through the pooled session, rate limited and retried """
+        return httpget(self.session, url, headers, retry=self.retry, limiter=self.limiter, auth=self.auth, **kw)
+
+    def close(self):
+        self.fetcher.close()
+        self.sessions.close()
+
+    def download(self, downloadDir, lang=None, skiplangs=['en', 'eng'], nozips=False, mapfile=None, workers=4, owned=True, prune=False, progress=True):
+        """ Sync downloadDir with the DBL. Only entries that are new, or whose revision
+            has changed since their zip was fetched, are downloaded, by workers threads
+            taking the entries with most to fetch first. If prune is set, zips of
+            entries that have left the DBL or been refiled under another language
+            code are deleted. Metrics for the run are written to download-metrics.json
+            and download-metrics.prom in downloadDir. """
+        entries, httpResult = self.getjson(self.baseurl+'/api/entries') # + ('' if owned else '/visible_entries'))
         if httpResult != 200:
             logging.error("ERROR in obtaining DBL entries; HTTP response code = " + str(httpResult))
             return
@@ -187,40 +240,90 @@ class DBLReader(object):
                 ptxmap = json.load(inf)
         else:
             ptxmap = {'PTX': {}, 'lang': {}}
-        jobs = []
+        catalog = {}
         for e in entries['entries']:
             l = e['languageCode']
             langcode = ptxmap['PTX'].get(e['idParatextName'], ptxmap['lang'].get(l, l))
             if langcode == "":
                 continue
-            eid = e['id']
-            key = "{}_{}".format(langcode, eid)
-            outEntries[key] = e
+            catalog[e['id']] = (langcode, e)
+
+        store = EntryStore(downloadDir)
+        oldzips = {eid: "{}_{}.zip".format(v[0], eid) for eid, v in store.items()}
+        delta = store.update(catalog)
+        logger.info("DBL catalog: {} new, {} changed, {} removed, {} unchanged entries".format(
+                        len(delta.new), len(delta.changed), len(delta.removed), len(delta.unchanged)))
+        if prune:
+            for eid in delta.removed + delta.changed:
+                oldpath = os.path.join(downloadDir, oldzips[eid])
+                if eid in catalog and oldzips[eid] == "{}_{}.zip".format(catalog[eid][0], eid):
+                    continue
+                if os.path.exists(oldpath):
+                    logger.info("Removing {}".format(oldpath))
+                    os.unlink(oldpath)
+
+        wanted = []
+        revisions = {}
+        for eid, (langcode, e) in catalog.items():
             if nozips or e['entrytype'] != 'text':
                 continue
             if (lang is not None and lang != langcode) \
                     or langcode in skiplangs:
                 continue
-            jobs.append((self, eid, langcode, downloadDir, nozips, logger))
-        if pool is None:
-            for j in jobs:
-                doone(j)
-        else:
-            print("doing {} jobs in parallel".format(len(jobs)))
-            list(pool.imap_unordered(doone, jobs))
-        entryfname = "entries_{}.json".format(lang) if lang is not None else "entries.json"
-        with open(os.path.join(downloadDir, entryfname), "w") as outf:
-            json.dump(outEntries, outf, indent=2)
+            fpath = os.path.join(downloadDir, "{}_{}.zip".format(langcode, eid))
+            if not store.needsFetch(eid, fpath):
+                continue
+            revisions[eid] = entryRevision(e)
+            wanted.append((eid, langcode))
+
+        # The files lists give the sizes the schedule is costed on
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            lists = list(executor.map(lambda w: self.getFilesList(w[0]), wanted))
+        telemetry = Telemetry()
+        metrics = {}
+        jobs = []
+        for (eid, langcode), files in zip(wanted, lists):
+            if files is None:
+                logger.error("Could not get the files list for {}_{}".format(langcode, eid))
+                continue
+            metrics[eid] = telemetry.entry(eid, langcode)
+            jobs.append((entryCost(files['list']), eid, entryBytes(files['list']),
+                         (eid, langcode, downloadDir, nozips, logger, True, revisions[eid], files, metrics[eid])))
+        total = sum(j[2] for j in jobs)
+        logger.info("Downloading {} entries, {:.1f} MB, with {} workers".format(len(jobs), total / 1e6, workers))
+        tracker = Progress(total, len(jobs)) if progress and len(jobs) else None
+        saved = [0, 0]
+        errors = {}
+        for eid, done in schedule(jobs, self.downloadOneEntry, workers=workers, progress=tracker, errors=errors):
+            metrics[eid].finish(bool(done), error=errors.get(eid, None))
+            if done:
+                store.markFetched(eid, revisions[eid])
+                saved[0] += done['cachedfiles']
+                saved[1] += done['cachedbytes']
+        store.close()
+        if self.blobs is not None:
+            logger.info("Blob store saved fetching {} files, {} bytes".format(*saved))
+        telemetry.finish()
+        totals = telemetry.write(downloadDir)['totals']
+        logger.info("Fetched {} files, {} bytes at {:.2f} MB/s with {} retries; {} of {} entries ok".format(
+                        totals['files_fetched'], totals['bytes_fetched'], totals['MB_per_s'], totals['retries'],
+                        totals['entries_ok'], totals['entries']))
         return True
-        
+
+    def getFilesList(self, entryId):
+        """ The files list of the latest revision of an entry, or None """
+        try:
+            filesList, httpResult = self.getjson(self.baseurl+'/api/entries/' + entryId + "/revisions/latest/license/owner")
+        except requests.exceptions.ConnectionError:
+            return None
+        return filesList if httpResult == 200 else None
 
     def testAccess(self):
-        response = requests.get(dblurl,
-                                auth=self.auth, headers=self._jsonHeaders())
+        response = self._get(self.baseurl, self._jsonHeaders)
         return response.status_code
 
     def getjson(self, url):
-        response = requests.get(url, auth=self.auth, headers=self._jsonHeaders())
+        response = self._get(url, self._jsonHeaders)
         if response.status_code == 200:
             return (json.loads(response.content), response.status_code)
         else:
@@ -229,50 +332,173 @@ class DBLReader(object):
     def getdata(self, url, length=0):
         exti = url.rfind(".")
         ext = url[exti+1:] if exti > -1 else "dat"
-        response = requests.get(url, auth=self.auth, headers=self._fileHeaders(ext, length))
+        response = self._get(url, lambda: self._fileHeaders(ext, length))
         if response.status_code == 200:
             return (response.content, response.status_code)
         else:
             return (None, response.status_code)
 
-    def getLicenses(self):
-        return self.getjson(dblurl+'/api/licenses')
+    def getfile(self, url, outf, size=None, metrics=None):
+        """ Stream the file at url into outf, checking it against size if given.
+            Returns (number of bytes or None, http status). If metrics is a dict
+            it is given the status, bytes, time to first byte, transfer time
+            and retries of the request. """
+        exti = url.rfind(".")
+        ext = url[exti+1:] if exti > -1 else "dat"
+        with self._get(url, lambda: self._fileHeaders(ext, 0), stream=True) as response:
+            if metrics is not None:
+                metrics.update(status=response.status_code, bytes=0, ttfb=response.elapsed.total_seconds(),
+                               transfer=None, retries=getattr(response, 'retries', 0))
+            if response.status_code != 200:
+                return (None, response.status_code)
+            start = time.monotonic()
+            try:
+                count = streamResponse(response, outf, size=size)
+            except SizeError as e:
+                logger.warning(str(e))
+                return (None, response.status_code)
+            finally:
+                if metrics is not None:
+                    metrics['transfer'] = time.monotonic() - start
+            if metrics is not None:
+                metrics['bytes'] = count
+            return (count, response.status_code)
 
-    def downloadOneEntry(self, entryId, langCode, downloadPath, nozips=False, logger=None):
+    def getLicenses(self):
+        return self.getjson(self.baseurl+'/api/licenses')
+
+    def downloadOneEntry(self, entryId, langCode, downloadPath, nozips=False, logger=None, replace=False, revision=None,
+                         filesList=None, metrics=None, progress=None):
+        """ Download an entry into {langCode}_{entryId}.zip, replacing an existing
+            zip only if replace is set. Returns a dict of file and byte counts,
+            including those served from the blob store, if a zip was written.
+            Files are staged as they arrive so an interrupted download of the
+            same revision resumes, and the zip is only put in place once complete.
+            filesList saves fetching the files list again, metrics is an EntryMetrics
+            to record each file in, and progress.add() is told the size of each
+            file as it is dealt with. """
         # Get the metadata that includes the license key for reading.
         fname = "{}_{}.zip".format(langCode, entryId)
         fpath = os.path.join(downloadPath, fname)
-        if os.path.exists(fpath):
-            return
-        filesUrl = dblurl+'/api/entries/' + entryId + "/revisions/latest/license/owner"
-        try:
-            filesList, httpResult = self.getjson(filesUrl)
-        except requests.exceptions.ConnectionError:
-            if logger is not None:
-                logger.error("Timeout while trying to start {}".format(fpath))
-            return
-        if httpResult != 200:
+        if os.path.exists(fpath) and not replace:
             return
+        filesUrl = self.baseurl+'/api/entries/' + entryId + "/revisions/latest/license/owner"
+        if filesList is None:
+            try:
+                filesList, httpResult = self.getjson(filesUrl)
+            except requests.exceptions.ConnectionError:
+                if logger is not None:
+                    logger.error("Timeout while trying to start {}".format(fpath))
+                return
+            if httpResult != 200:
+                return
         if not nozips:
+            stage = StagedEntry(downloadPath, fname[:-4], revision)
             if logger is not None:
-                logger.info("Downloading: " + entryId + " - " + langCode)
-            zfile = ZipFile(fpath, "w")
-            for e in filesList['list']:
-                length = int(e['size'])
-                fname = e['uri']
-                try:
-                    (dat, result) = self.getdata("{}/{}".format(filesUrl, fname))
-                except requests.exceptions.ConnectionError:
-                    zfile.close()
-                    os.unlink(fpath)
-                    if logger is not None:
-                        logger.error("Timeout while trying to load files for {}".format(fpath))
-                    return
+                if len(stage.done):
+                    logger.info("Resuming: " + entryId + " - " + langCode
+                                + " with {} files already fetched".format(len(stage.done)))
+                else:
+                    logger.info("Downloading: " + entryId + " - " + langCode)
+            stats = {'files': 0, 'bytes': 0, 'cachedfiles': 0, 'cachedbytes': 0, 'resumedfiles': 0}
+            found = {}
+            def fromcache(e):
+                rec = stage.get(e)
+                if rec is not None:
+                    dat = stage.open(rec, self.blobs)
+                    if dat is not None:
+                        found[e['uri']] = 'resumed'
+                        return dat
+                if self.blobs is None:
+                    return None
+                key = self.blobs.keyFor(e)
+                dat = self.blobs.open(key) if key is not None else None
                 if dat is not None:
-                    zfile.writestr(fname, dat)
-            zfile.close()
+                    found[e['uri']] = key
+                return dat
+            timings = {} if metrics is not None else None
+            def record(e, how, nbytes):
+                if metrics is None:
+                    return
+                if how is None:
+                    t = timings.get(e['uri'], {})
+                    metrics.file(e['uri'], t.get('status', None), t.get('bytes', 0), ttfb=t.get('ttfb', None),
+                                 transfer=t.get('transfer', None), retries=t.get('retries', 0))
+                else:
+                    metrics.file(e['uri'], None, nbytes, cache='resumed' if how == 'resumed' else 'blob')
+            def tostage(e):
+                return open(stage.filename(e['uri']), "w+b")
+            # The zip is built in the staging directory, so one left by a process that was killed
+            # is overwritten by the next attempt and goes when the entry is published. Partial
+            # zips kept beside the published ones by older versions are cleared up here.
+            for old in glob.glob(os.path.join(glob.escape(downloadPath), glob.escape(fname) + "*.part")):
+                os.unlink(old)
+            tmppath = os.path.join(stage.path, fname + ".part")
+            zfile = ZipFile(tmppath, "w")
+            def addfile(e, dat, result):
+                if progress is not None:
+                    progress.add(int(e.get('size', None) or 0))
+                if dat is None:
+                    record(e, None, 0)
+                    return
+                uri = e['uri']
+                how = found.get(uri, None)
+                if how is None:
+                    if self.blobs is not None:
+                        key = self.blobs.add(dat)
+                        expected = self.blobs.keyFor(e)
+                        if expected is not None and key != expected:
+                            if logger is not None:
+                                logger.warning("{} in {} does not match its checksum, skipping".format(uri, fname))
+                            record(e, None, 0)
+                            return
+                        dat = self.blobs.open(key)
+                        stage.add(uri, int(key[:key.index("-")]), blob=key)
+                    else:
+                        dat.flush()
+                        os.fsync(dat.fileno())
+                        # the fetch has already rewound it, so its size is not where it stands
+                        stage.add(uri, os.fstat(dat.fileno()).st_size)
+                elif how != 'resumed':
+                    stage.add(uri, int(how[:how.index("-")]), blob=how)
+                try:
+                    with zfile.open(uri, 'w', force_zip64=True) as outf:
+                        copyfileobj(dat, outf, CHUNKSIZE)
+                finally:
+                    dat.close()
+                size = zfile.getinfo(uri).file_size
+                record(e, how, size)
+                stats['files'] += 1
+                stats['bytes'] += size
+                if how == 'resumed':
+                    stats['resumedfiles'] += 1
+                elif how is not None:
+                    stats['cachedfiles'] += 1
+                    stats['cachedbytes'] += size
+            try:
+                self.fetcher.fetchAll(filesUrl, filesList['list'], addfile, cached=fromcache,
+                                      opener=tostage if self.blobs is None else None, timings=timings)
+                zfile.close()
+                with open(tmppath, "rb") as inf:
+                    os.fsync(inf.fileno())
+                os.replace(tmppath, fpath)
+            except requests.exceptions.ConnectionError:
+                if logger is not None:
+                    logger.error("Timeout while trying to load files for {}, {} files kept for resuming".format(
+                                    fpath, len(stage.done)))
+                return
+            finally:
+                zfile.close()
+                if os.path.exists(tmppath):
+                    os.unlink(tmppath)
+                stage.close()
+            stage.remove()
             if logger is not None:
                 logger.info("Finished: " + entryId + " - " + langCode)
+                if stats['cachedfiles']:
+                    logger.info("{} files, {} bytes of {} reused from the blob store".format(
+                                    stats['cachedfiles'], stats['cachedbytes'], fname))
+            return stats
         return
 
     def _jsonHeaders(self):
@@ -298,23 +524,38 @@ def main():
     pass
 
 
+def book_text(job):
+    """ Pool worker for DBL.analyze_text: the paragraphs of one book of a project """
+    (dblobj, filename) = job
+    return dblobj.book_text(filename)
+
+
 class DBL(object):
+    # Bump this whenever a change alters the text analyze_text yields or how it is cached, to invalidate cached text
+    textrules = "newdbl-2"
 
     def __init__(self):
         self.exemplars = Exemplars()
         # For DBL data, we have our doubts as to whether frequency is a good indicator of whether a character
         # is main or auxiliary. So set the threshold to zero which will treat all characters found as main.
         self.project = None
+        self.source = None
+        self.zipfilename = None
+        self.index = None
         self.publishable = set()
+        self.accepted = frozenset()
         self.main_text = ('ip', 's', 'p', 'q')
+        self.textcache = defaultTextCache()
 
     def open_project(self, zipfilename):
         """Open a DBL project zip file."""
+        self.zipfilename = zipfilename
         self.project = zipfile.ZipFile(zipfilename, 'r')
+        self.index = ProjectIndex(self.project.namelist())
         # self.corpus = codecs.open(zipfilename + '.main.txt', 'w', encoding='utf-8')
 
     def namelist(self):
-        return self.project.namelist()
+        return self.index.names
 
     def query_project(self):
         """Query a DBL project for ad-hoc information.
@@ -325,103 +566,216 @@ class DBL(object):
 
         # Find stylesheets.
         found = False
-        for filename in self.project.namelist():
-            if os.path.basename(filename) == 'styles.xml':
-                found = True
-                print(filename)
+        for filename in self.index.withRole('stylesheet'):
+            found = True
+            print(filename)
         if not found:
             print("not found!")
 
-    def analyze_text(self):
-        """Analyse the scripture text. Iterates yielding text strings"""
+    def analyze_text(self, pool=None):
+        """Analyse the scripture text. Iterates yielding text strings.
+        Given a multiprocessing pool, the books are extracted in parallel,
+        each worker opening the zip for itself, and the text comes back in
+        the same order as it would without. If the zip is unchanged since
+        its text was last extracted the text comes from self.textcache."""
+        for para in self._paragraphs(pool):
+            for run in para:
+                for text in run:
+                    yield text
+
+    def analyze_batches(self, by='paragraph', size=4096, pool=None):
+        """Analyse the scripture text, yielding it in lists of strings rather
+        than a string at a time. by is 'paragraph' for a list per paragraph,
+        'verse' for a list per verse (and per stretch of a paragraph before
+        its first verse), or 'chunk' for lists of at least size characters
+        (bar the last). The strings, and their order, are exactly those of
+        analyze_text; only empty batches are left out."""
+        if by not in ('paragraph', 'verse', 'chunk'):
+            raise ValueError("Unknown batch type {}".format(by))
+        batch = []
+        length = 0
+        for para in self._paragraphs(pool):
+            if by == 'verse':
+                for run in para:
+                    yield run
+            elif by == 'paragraph':
+                yield [text for run in para for text in run]
+            else:
+                for run in para:
+                    batch.extend(run)
+                    length += sum(map(len, run))
+                if length >= size:
+                    yield batch
+                    batch = []
+                    length = 0
+        if len(batch):
+            yield batch
+
+    def _paragraphs(self, pool=None):
+        """The accepted paragraphs of the text as lists of verse runs, from
+        self.textcache if possible. Each run is a non-empty list of strings."""
+        if self.textcache is not None and self.zipfilename is not None:
+            rules = "{}:{}".format(self.textrules, ",".join(self.main_text))
+            paras = self.textcache.get(self.zipfilename, rules)
+            if paras is None:
+                paras = self.textcache.put(self.zipfilename, rules, self._extract_text(pool))
+        else:
+            paras = self._extract_text(pool)
+        return paras
 
+    def _extract_text(self, pool=None):
+        """Extract the paragraphs from the zip itself, as _paragraphs describes."""
         # Read stylesheet.
         found_stylesheet = False
-        for filename in self.project.namelist():
-            if os.path.basename(filename) == 'styles.xml':
-                found_stylesheet = True
-                style = self.project.open(filename, 'r')
-                self._read_stylesheet(style)
+        for filename in self.index.withRole('stylesheet'):
+            found_stylesheet = True
+            style = self.project.open(filename, 'r')
+            self._read_stylesheet(style)
         if not found_stylesheet:
             raise IOError('stylesheet not found')
 
         # Process text data.
-        for filename in self.project.namelist():
-            if filename.endswith('.usx'):
-                usx = self.project.open(filename, 'r')
-                for text in self._process_usx_file(usx):
-                    yield text
-                    # self.exemplars.process(text)
-                    # self.corpus.write(text + '\n')
+        if pool is not None:
+            for paras in pool.imap(book_text, [(self, f) for f in self.index.withExt('usx')]):
+                for para in paras:
+                    yield para
+            return
+        for filename in self.index.withExt('usx'):
+            usx = self.project.open(filename, 'r')
+            for para in self._process_usx_paragraphs(usx):
+                yield para
+                # self.exemplars.process(text)
+                # self.corpus.write(text + '\n')
+
+    def book_text(self, filename):
+        """Return the paragraphs of one USX member as a list."""
+        if self.project is None:
+            self.project = sharedZip(self.zipfilename)
+        return list(self._process_usx_paragraphs(self.project.open(filename, 'r')))
 
     def _read_stylesheet(self, style):
-        """Read stylesheet and record which markers are publishable."""
-        tree = ET.parse(style)
-        for marker in tree.findall('style'):
-            if marker.get('publishable') == 'true':
-                self.publishable.add(marker.get('id'))
+        """Read stylesheet and record which markers are publishable, and which
+        of those are main text."""
+        (publishable, accepted) = compileStylesheet(style, self.main_text)
+        self.publishable.update(publishable)
+        self.accepted |= accepted
 
     def _process_usx_file(self, usx):
-        """Process one USX file."""
-        tree = ET.parse(usx)
-        root = next(tree.iter())
-        for marker in list(root):
-            style = marker.get('style')
-            if style in self.publishable and style.startswith(self.main_text):
-                for text in self._get_text(marker):
+        """Process one USX file, a paragraph at a time."""
+        for para in self._process_usx_paragraphs(usx):
+            for run in para:
+                for text in run:
                     yield text
+
+    def _process_usx_paragraphs(self, usx):
+        """Process one USX file, yielding each accepted paragraph as a list of
+        runs of text, split where a verse starts."""
+        for marker in iterParagraphs(usx):
+            if marker.get('style') in self.accepted:
+                runs = [[]]
+                for text in self._get_text(marker, verses=True):
+                    if text is not None:
+                        runs[-1].append(text)
+                    elif len(runs[-1]):
+                        runs.append([])
+                if not len(runs[-1]):
+                    runs.pop()
+                if len(runs):
+                    yield runs
         usx.close()
 
     def file_contents_with_ext(self, ext):
         """Return the contents of the file with the given extension, if any."""
-        for filename in self.project.namelist():
-            if filename.endswith('.'+ext):
-                contents = self.project.open(filename, 'r')
-                return contents
+        filename = self.index.firstWithExt(ext)
+        if filename is not None:
+            return self.project.open(filename, 'r')
         return None
 
     def extract_file_with_ext(self, ext, newname=None):
         """Return the contents of the file with the given extension, if any."""
-        for filename in self.project.namelist():
-            if filename.endswith('.' + ext):
-                self.project.extract(filename)
-                if newname is not None:
-                    if os.path.exists(newname):
-                        os.remove(newname)
-                    copyfile(filename, newname)
-                    os.remove(filename)
-                return
+        filename = self.index.firstWithExt(ext)
+        if filename is not None:
+            self.project.extract(filename)
+            if newname is not None:
+                if os.path.exists(newname):
+                    os.remove(newname)
+                copyfile(filename, newname)
+                os.remove(filename)
 
     def extract_file(self, filename):
-        if filename in self.project.namelist():
+        if filename in self.index:
             self.project.extract(filename)
             return True
         else:
             return False
 
-    def _get_text(self, element):
+    def _get_text(self, element, verses=False):
         """Extract all text from an ET Element."""
         # for text in element.itertext():
-        for text in self.iter_main_text(element):
-            yield text.strip()
+        for text in self.iter_main_text(element, verses):
+            yield text.strip() if text is not None else None
 
-    def iter_main_text(self, element):
-        """Extract all text (except notes) from an ET Element."""
+    def iter_main_text(self, element, verses=False):
+        """Extract all text (except notes) from an ET Element, in document order.
+        If verses is set, None is yielded where each verse starts."""
         if element.tag == 'note':
             return
         if element.text:
             yield element.text
-        for e in element:
-            for se in self.iter_main_text(e):
-                yield se
-            if e.tail:
-                yield e.tail
+        # Walk the tree with an explicit stack rather than nested generators.
+        # tails[i] is the tail of the element whose children stack[i+1] runs over.
+        stack = [iter(element)]
+        tails = []
+        while len(stack):
+            e = next(stack[-1], None)
+            if e is None:
+                stack.pop()
+                if len(tails):
+                    tail = tails.pop()
+                    if tail:
+                        yield tail
+            elif e.tag == 'note':
+                if e.tail:
+                    yield e.tail
+            else:
+                if verses and e.tag == 'verse':
+                    yield None
+                if e.text:
+                    yield e.text
+                stack.append(iter(e))
+                tails.append(e.tail)
+
+    def open_source(self):
+        """Return the project's source/source.zip as a ZipFile, or None if it
+        has none. It is unpacked once and kept until close_project."""
+        if self.source is None:
+            try:
+                self.source = openNested(self.project, "source/source.zip")
+            except KeyError:
+                return None
+        return self.source
 
     def close_project(self):
         """Close a DBL project."""
         self.project.close()
+        if self.source is not None:
+            self.source.close()
+            self.source = None
         # self.corpus.close()
 
+    # Pool workers get just what they need to extract text, and open the zip themselves
+    def __getstate__(self):
+        return {'zipfilename': self.zipfilename, 'publishable': self.publishable,
+                'accepted': self.accepted, 'main_text': self.main_text}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.project = None
+        self.source = None
+        self.index = None
+        self.textcache = None
+        self.exemplars = None
+
 def exceptions():
 
 # putting this here so I can pull it into the other modules in the scripts directory
@@ -0,0 +1,248 @@
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+# A persistent catalog of the LDML files in an SLDR tree
+
+import os
+import json
+import hashlib
+import logging
+import sqlite3
+from collections import namedtuple
+from xml.etree import ElementTree as et
+
+logger = logging.getLogger(__name__)
+
+SILNS = "urn://www.sil.org/ldml/0.1"
+
+# Bump this if what is cataloged changes, to rebuild existing catalogs
+CATALOGVERSION = 1
+
+# What the catalog knows of one LDML file. tag is the file name without
+# .xml, with hyphens. script is identity/script, else the sil:identity
+# script. identity is the sil:identity attributes and source the
+# source of them. version and generation are the identity version number
+# and generation date. fonts are the attributes of each sil:font,
+# exemplars map each exemplarCharacters type ('' for main) to its text,
+# direction is the layout characterOrder, collation says whether the
+# standard collation has a sil:simple list and whether it has a tailoring.
+# error is why the file could not be read, if it could not.
+LdmlInfo = namedtuple("LdmlInfo", ["tag", "path", "language", "script", "territory", "variant", "identity",
+                                   "source", "version", "generation", "fonts", "exemplars", "direction",
+                                   "collation", "error"])
+
+_fields = LdmlInfo._fields[2:]
+
+
+def readLdml(path):
+    """ Read the catalog fields of the LDML file at path, as a dict """
+    res = dict.fromkeys(_fields)
+    res.update(identity={}, fonts=[], exemplars={}, collation={})
+    try:
+        root = et.parse(path).getroot()
+    except (et.ParseError, OSError) as e:
+        res['error'] = str(e)
+        return res
+    identity = root.find('identity')
+    if identity is not None:
+        for k in ('language', 'script', 'territory', 'variant'):
+            e = identity.find(k)
+            if e is not None:
+                res[k] = e.get('type')
+        e = identity.find('version')
+        if e is not None:
+            res['version'] = e.get('number')
+        e = identity.find('generation')
+        if e is not None:
+            res['generation'] = e.get('date')
+        e = identity.find('special/{%s}identity' % SILNS)
+        if e is not None:
+            res['identity'] = dict(e.attrib)
+            res['source'] = e.get('source')
+            if res['script'] is None:
+                res['script'] = e.get('script')
+    res['fonts'] = [dict(e.attrib) for e in root.iterfind('special/{%s}external-resources/{%s}font' % (SILNS, SILNS))]
+    for e in root.iterfind('characters/exemplarCharacters'):
+        t = e.get('type', '')
+        # the unqualified element is preferred over any alt
+        if t not in res['exemplars'] or e.get('alt') is None:
+            res['exemplars'][t] = e.text or ''
+    e = root.find('layout/orientation/characterOrder')
+    if e is not None:
+        res['direction'] = e.text or ''
+    for e in root.iterfind('collations/collation'):
+        if e.get('type') == 'standard':
+            cr = e.find('cr')
+            res['collation'] = {'simple': e.find('special/{%s}simple' % SILNS) is not None,
+                                'tailoring': cr is not None and cr.text is not None
+                                             and ("<" in cr.text or "&" in cr.text)}
+    return res
+
+
+def catalogDir():
+    """ $WSTOOLS_SLDRCATALOG, else wstools/sldrcatalog in the user's cache directory """
+    path = os.getenv("WSTOOLS_SLDRCATALOG", None)
+    if path is None:
+        base = os.getenv("XDG_CACHE_HOME", None) or os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, "wstools", "sldrcatalog")
+    return path
+
+
+class SldrCatalog(object):
+    """Catalog of every .xml file under an SLDR tree, kept in sqlite.
+
+    refresh() brings it up to date, reading only the files whose size or
+    modification time has changed since they were cataloged, so that
+    scripts can look up what they need about an LDML file without
+    parsing it, or list the tree without walking it. Lookups are by tag,
+    with either hyphens or underscores.
+    """
+
+    schema = """CREATE TABLE IF NOT EXISTS ldml (
+                    path TEXT PRIMARY KEY,
+                    tag TEXT NOT NULL,
+                    fnlang TEXT NOT NULL,
+                    stat TEXT NOT NULL,
+                    info TEXT NOT NULL)"""
+
+    def __init__(self, sldrdir, path=None):
+        self.sldrdir = os.path.abspath(sldrdir)
+        if path is None:
+            key = hashlib.md5("{}:{}".format(CATALOGVERSION, self.sldrdir).encode("utf-8")).hexdigest()[:16]
+            os.makedirs(catalogDir(), exist_ok=True)
+            path = os.path.join(catalogDir(), "sldr-{}.db".format(key))
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60)
+        with self.db:
+            self.db.execute(self.schema)
+            self.db.execute("CREATE INDEX IF NOT EXISTS ldml_tag ON ldml (tag)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS ldml_fnlang ON ldml (fnlang)")
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM ldml").fetchone()[0]
+
+    def refresh(self):
+        """Catalog new and changed files and drop missing ones. Returns the
+        number of files read and the number dropped."""
+        known = dict(self.db.execute("SELECT path, stat FROM ldml"))
+        seen = set()
+        changed = []
+        for (dirpath, dirnames, filenames) in os.walk(self.sldrdir):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for f in filenames:
+                if not f.endswith(".xml"):
+                    continue
+                relpath = os.path.relpath(os.path.join(dirpath, f), self.sldrdir)
+                seen.add(relpath)
+                st = os.stat(os.path.join(dirpath, f))
+                stat = "{}:{}".format(st.st_size, st.st_mtime_ns)
+                if known.get(relpath, None) != stat:
+                    changed.append((relpath, stat))
+        removed = [p for p in known if p not in seen]
+        with self.db:
+            for (relpath, stat) in changed:
+                info = readLdml(os.path.join(self.sldrdir, relpath))
+                if info['error'] is not None:
+                    logger.warning("Unable to read {}: {}".format(relpath, info['error']))
+                stem = os.path.basename(relpath)[:-4]
+                self.db.execute("INSERT OR REPLACE INTO ldml VALUES (?, ?, ?, ?, ?)",
+                                (relpath, stem.replace("-", "_"), stem.split("_")[0], stat, json.dumps(info)))
+            self.db.executemany("DELETE FROM ldml WHERE path=?", [(p,) for p in removed])
+        return (len(changed), len(removed))
+
+    def get(self, tag, current=False):
+        """ The LdmlInfo for tag, or None. Where a tag is in more than one
+            subdirectory, the first path in order is taken. If current is
+            set, None is also returned if the file has changed on disk since
+            it was cataloged. """
+        row = self.db.execute("SELECT path, info, stat FROM ldml WHERE tag=? ORDER BY path",
+                              (tag.replace("-", "_"),)).fetchone()
+        if row is None:
+            return None
+        if current:
+            try:
+                st = os.stat(os.path.join(self.sldrdir, row[0]))
+            except FileNotFoundError:
+                return None
+            if row[2] != "{}:{}".format(st.st_size, st.st_mtime_ns):
+                return None
+        return self._info(row[:2])
+
+    def pathFor(self, tag):
+        info = self.get(tag)
+        return info.path if info is not None else None
+
+    def forLanguage(self, lang):
+        """ Infos for the files whose names start with the language lang, in path order """
+        return [self._info(r) for r in self.db.execute("SELECT path, info FROM ldml WHERE fnlang=? ORDER BY path",
+                                                       (lang,))]
+
+    def forDirectory(self, subdir):
+        """ Infos for the files in the top level subdirectory subdir, in path order """
+        prefix = subdir + os.sep
+        return [self._info(r) for r in self.db.execute("SELECT path, info FROM ldml WHERE substr(path, 1, ?)=? ORDER BY path",
+                                                       (len(prefix), prefix))]
+
+    def __iter__(self):
+        for r in self.db.execute("SELECT path, info FROM ldml ORDER BY path").fetchall():
+            yield self._info(r)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        self.close()
+
+    def _info(self, row):
+        (relpath, info) = row
+        return LdmlInfo(tag=os.path.basename(relpath)[:-4].replace("_", "-"),
+                        path=os.path.join(self.sldrdir, relpath), **json.loads(info))
+
+
+# The catalogs this process has opened, by SLDR directory
+_catalogs = {}
+
+
+def catalogFor(sldrdir, refresh=True):
+    """The catalog of sldrdir, refreshed the first time this process asks
+    for it. A catalog opened before a fork is not used after it. Workers
+    of a run whose parent has refreshed the catalog can pass refresh=False
+    to skip walking the tree again, and rely on get(current=True) to
+    notice files that changed since."""
+    key = os.path.abspath(sldrdir)
+    res = _catalogs.get(key, None)
+    if res is None or res[0] != os.getpid():
+        res = (os.getpid(), SldrCatalog(sldrdir), False)
+        _catalogs[key] = res
+    if refresh and not res[2]:
+        (changed, removed) = res[1].refresh()
+        if changed or removed:
+            logger.info("Cataloged {} changed and {} removed LDML files in {}".format(changed, removed, sldrdir))
+        res = (res[0], res[1], True)
+        _catalogs[key] = res
+    return res[1]
@@ -26,6 +26,8 @@
 
 import os
 import sys
+import shutil
+import tempfile
 import unittest
 
 try:
@@ -34,20 +36,28 @@ except ImportError:
     sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib', 'wstools')))
     from dbl import DBL
 
+from fixtures import projectZip, tempTextCache
+
+
+testdir = os.path.dirname(os.path.abspath(__file__))
+
 
 class DBLTests(unittest.TestCase):
 
     def setUp(self):
-        self.dbl = DBL()
+        self.dir = tempfile.mkdtemp()
+        tempTextCache(self, self.dir)
+        self.dbl = DBL(projectZip(self.dir))
 
     def tearDown(self):
-        pass
+        self.dbl.project.close()
+        shutil.rmtree(self.dir)
 
     def test_get_text(self):
-        with open('styles.xml', 'r') as style:
+        with open(os.path.join(testdir, 'styles.xml'), 'r') as style:
             self.dbl._read_stylesheet(style)
 
-        with open('MAT.usx', 'r') as usx:
+        with open(os.path.join(testdir, 'MAT.usx'), 'r') as usx:
             all_text = ''
             for text in self.dbl._process_usx_file(usx):
                 all_text += text
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+try:
+    from wstools import newdbl, dblcorpus
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib', 'wstools')))
+    import newdbl, dblcorpus
+
+from fixtures import projectZip, tempTextCache
+
+
+class TextCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cachedir = tempTextCache(self, self.tmpdir)
+        self.zipname = projectZip(self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def entries(self, suffix=".txt.gz"):
+        return sorted(f for d, _, files in os.walk(self.cachedir) for f in files if f.endswith(suffix))
+
+    def extract(self, textrules=None, cache=True):
+        d = newdbl.DBL()
+        if not cache:
+            d.textcache = None
+        if textrules is not None:
+            d.textrules = textrules
+        d.open_project(self.zipname)
+        res = list(d.analyze_text())
+        d.close_project()
+        return res
+
+    def test_default(self):
+        self.assertEqual(self.cachedir, dblcorpus.defaultTextCache().path)
+        with mock.patch.dict(os.environ, {'WSTOOLS_TEXTCACHE': ""}):
+            self.assertIsNone(dblcorpus.defaultTextCache())
+
+    def test_hit(self):
+        uncached = self.extract(cache=False)
+        self.assertEqual([], self.entries())
+        self.assertEqual(uncached, self.extract())
+        self.assertEqual(1, len(self.entries()))
+        cache = dblcorpus.defaultTextCache()
+        rules = "{}:{}".format(newdbl.DBL.textrules, ",".join(newdbl.DBL().main_text))
+        self.assertIsNotNone(cache.get(self.zipname, rules))
+        self.assertEqual(uncached, self.extract())
+        self.assertEqual(1, len(self.entries()))
+
+    def test_miss(self):
+        first = self.extract()
+        self.assertEqual(1, len(self.entries()))
+        # a bump of the extraction rules
+        self.assertEqual(first, self.extract(textrules=newdbl.DBL.textrules + "-test"))
+        self.assertEqual(2, len(self.entries()))
+        # a changed zip
+        projectZip(self.tmpdir, {'release/extra.txt': "changed"})
+        cache = dblcorpus.defaultTextCache()
+        rules = "{}:{}".format(newdbl.DBL.textrules, ",".join(newdbl.DBL().main_text))
+        self.assertIsNone(cache.get(self.zipname, rules))
+        self.assertEqual(first, self.extract())
+        self.assertEqual(3, len(self.entries()))
+
+    def test_partial(self):
+        cache = dblcorpus.defaultTextCache()
+        texts = cache.put(self.zipname, "rules", iter(["a", "b", "c"]))
+        self.assertEqual("a", next(texts))
+        texts.close()
+        self.assertEqual([], self.entries())
+        self.assertEqual([], self.entries(".tmp"))
+        self.assertIsNone(cache.get(self.zipname, "rules"))
+
+        d = newdbl.DBL()
+        d.open_project(self.zipname)
+        texts = d.analyze_text()
+        next(texts)
+        texts.close()
+        d.close_project()
+        self.assertEqual([], self.entries())
+        self.assertEqual([], self.entries(".tmp"))
+
+        self.assertEqual(["a", "b", "c"], list(cache.put(self.zipname, "rules", iter(["a", "b", "c"]))))
+        self.assertEqual(["a", "b", "c"], list(cache.get(self.zipname, "rules")))
+        self.assertEqual([], self.entries(".tmp"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+#!/usr/bin/python
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import os
+import sys
+import json
+import shutil
+import zipfile
+import tempfile
+import unittest
+import requests
+
+try:
+    from wstools import newdbl, dblmock
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib', 'wstools')))
+    import newdbl, dblmock
+
+
+class InterruptingReader(newdbl.DBLReader):
+    """ A reader whose connection drops after the first few files """
+
+    def __init__(self, *a, **kw):
+        self.allowed = kw.pop('allowed')
+        super(InterruptingReader, self).__init__(*a, **kw)
+
+    def getfile(self, url, outf, size=None, metrics=None):
+        if self.allowed <= 0:
+            raise requests.exceptions.ConnectionError("dropped")
+        self.allowed -= 1
+        return super(InterruptingReader, self).getfile(url, outf, size=size, metrics=metrics)
+
+
+class FailingReader(newdbl.DBLReader):
+    """ A reader that cannot write the files of one entry """
+
+    def __init__(self, *a, **kw):
+        self.failing = kw.pop('failing')
+        super(FailingReader, self).__init__(*a, **kw)
+
+    def getfile(self, url, outf, size=None, metrics=None):
+        if self.failing in url:
+            raise OSError("No space left on device")
+        return super(FailingReader, self).getfile(url, outf, size=size, metrics=metrics)
+
+
+class DownloadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.library = dblmock.MockLibrary.synthetic(count=3, files=8, size=2000, shared=0.)
+        self.mock = dblmock.MockDBL(self.library)
+        self.url = self.mock.start()
+
+    def tearDown(self):
+        self.mock.stop()
+        shutil.rmtree(self.dir)
+
+    def reader(self, cls=newdbl.DBLReader, **kw):
+        return cls("mockkey1", "mockkey2", baseurl=self.url, perentry=1, retry=newdbl.RetryPolicy(retries=0), **kw)
+
+    def fetched(self):
+        return len(self.mock.stats()['filetimes'])
+
+    def test_resume(self):
+        eid = sorted(self.library.entries.keys())[0]
+        rdr = self.reader(InterruptingReader, allowed=3)
+        self.assertIsNone(rdr.downloadOneEntry(eid, "x00", self.dir, revision="1", replace=True))
+        rdr.close()
+        self.assertEqual(self.fetched(), 3)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "x00_{}.zip".format(eid))))
+        with open(os.path.join(self.dir, ".partial", "x00_{}".format(eid), "done.log")) as inf:
+            staged = [json.loads(l) for l in inf][1:]
+        self.assertEqual(len(staged), 3)
+        self.assertTrue(all(r['size'] > 0 for r in staged))
+
+        rdr = self.reader()
+        stats = rdr.downloadOneEntry(eid, "x00", self.dir, revision="1", replace=True)
+        rdr.close()
+        self.assertEqual(stats['resumedfiles'], 3)
+        self.assertEqual(stats['files'], 8)
+        # only the files that were not staged are fetched again
+        self.assertEqual(self.fetched(), 8)
+        self.assertTrue(os.path.exists(os.path.join(self.dir, "x00_{}.zip".format(eid))))
+
+    def test_stale_part(self):
+        eid = sorted(self.library.entries.keys())[0]
+        fname = "x00_{}.zip".format(eid)
+        # left by processes killed part way through writing the zip
+        old = os.path.join(self.dir, fname + "k3j_x.part")
+        staged = os.path.join(self.dir, ".partial", fname[:-4], fname + ".part")
+        os.makedirs(os.path.dirname(staged))
+        for p in (old, staged):
+            with open(p, "wb") as outf:
+                outf.write(b"PK\x03\x04truncated")
+        rdr = self.reader(InterruptingReader, allowed=3)
+        self.assertIsNone(rdr.downloadOneEntry(eid, "x00", self.dir, revision="1", replace=True))
+        rdr.close()
+        self.assertEqual([], self.parts())
+        rdr = self.reader()
+        self.assertEqual(8, rdr.downloadOneEntry(eid, "x00", self.dir, revision="1", replace=True)['files'])
+        rdr.close()
+        self.assertEqual([], self.parts())
+        self.assertFalse(os.path.exists(os.path.dirname(staged)))
+        with zipfile.ZipFile(os.path.join(self.dir, fname)) as z:
+            self.assertEqual(8, len(z.namelist()))
+
+    def parts(self):
+        return [f for d, _, files in os.walk(self.dir) for f in files if f.endswith(".part")]
+
+    def test_failed_entry(self):
+        eids = sorted(self.library.entries.keys())
+        rdr = self.reader(FailingReader, failing=eids[1])
+        self.assertTrue(rdr.download(self.dir, skiplangs=[], workers=2, progress=False))
+        rdr.close()
+        zips = {e: os.path.join(self.dir, "{}_{}.zip".format(self.library.entries[e][0]['languageCode'], e))
+                for e in eids}
+        self.assertEqual([os.path.exists(zips[e]) for e in eids], [True, False, True])
+        with open(os.path.join(self.dir, "download-metrics.json")) as inf:
+            report = json.load(inf)
+        status = {e['id']: (e['status'], e['error']) for e in report['entries']}
+        self.assertEqual(status[eids[0]], ('ok', None))
+        self.assertEqual(status[eids[1]][0], 'failed')
+        self.assertIn("No space left", status[eids[1]][1])
+        with newdbl.EntryStore(self.dir) as store:
+            self.assertEqual([store.needsFetch(e, zips[e]) for e in eids], [False, True, False])
+
+        # the next sync picks up only the entry that failed
+        before = self.fetched()
+        rdr = self.reader()
+        rdr.download(self.dir, skiplangs=[], workers=2, progress=False)
+        rdr.close()
+        self.assertTrue(os.path.exists(zips[eids[1]]))
+        self.assertEqual(self.fetched() - before, 8)
+
+    def test_no_revision(self):
+        eids = sorted(self.library.entries.keys())
+        for e in eids:
+            del self.library.entries[e][0]['revision']
+        rdr = self.reader()
+        rdr.download(self.dir, skiplangs=[], workers=2, progress=False)
+        rdr.close()
+        self.assertEqual(self.fetched(), 24)
+        zips = {e: os.path.join(self.dir, "{}_{}.zip".format(self.library.entries[e][0]['languageCode'], e))
+                for e in eids}
+        with newdbl.EntryStore(self.dir) as store:
+            self.assertEqual([store.needsFetch(e, zips[e]) for e in eids], [False] * 3)
+
+        # a second sync fetches nothing, until an entry gains a revision
+        rdr = self.reader()
+        rdr.download(self.dir, skiplangs=[], workers=2, progress=False)
+        rdr.close()
+        self.assertEqual(self.fetched(), 24)
+        self.library.entries[eids[2]][0]['revision'] = 2
+        rdr = self.reader()
+        rdr.download(self.dir, skiplangs=[], workers=2, progress=False)
+        rdr.close()
+        self.assertEqual(self.fetched(), 32)
+
+
+if __name__ == '__main__':
+    unittest.main()
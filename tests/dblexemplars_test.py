@@ -0,0 +1,94 @@
+#!/usr/bin/python
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import os
+import sys
+import unittest
+import multiprocessing
+from collections import Counter
+
+try:
+    from wstools import dblexemplars
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib', 'wstools')))
+    import dblexemplars
+
+from sldr.ldml_exemplars import Exemplars
+
+testdir = os.path.dirname(os.path.abspath(__file__))
+
+
+class State(object):
+    """ Stands in for the counting state of an Exemplars """
+    def __init__(self):
+        self.clusters = Counter()
+        self.seen = []
+        self.marks = {}
+        self.script = ''
+
+
+class ExemplarTests(unittest.TestCase):
+
+    def texts(self):
+        with open(os.path.join(testdir, 'MAT.usx'), encoding='utf-8') as inf:
+            res = [l.strip() for l in inf]
+        return res + ["ἐν ἀρχῇ ἦν ὁ λόγος", "بسم الله", "Ñandú café", ""] * 50
+
+    def batches(self, size=7):
+        texts = self.texts()
+        return [texts[i:i+size] for i in range(0, len(texts), size)]
+
+    def test_sharded(self):
+        serial = Exemplars()
+        serial.frequent = 0.0
+        for t in self.texts():
+            serial.process(t)
+        serial.analyze()
+        sharded = Exemplars()
+        sharded.frequent = 0.0
+        with multiprocessing.Pool(2) as pool:
+            acc = dblexemplars.ExemplarAccumulator(sharded, pool=pool, shardchars=200)
+            for b in self.batches():
+                acc.feed(b)
+            acc.finish().analyze()
+        self.assertEqual(dblexemplars.snapshot(serial), dblexemplars.snapshot(sharded))
+
+    def test_merge(self):
+        state = State()
+        state.clusters['a'] = 1
+        acc = dblexemplars.ExemplarAccumulator(state)
+        acc.template = dblexemplars.snapshot(State())
+        acc.merge({'clusters': Counter({'b': 2, 'a': 1}), 'seen': ['x'], 'marks': {'m': {'a'}}})
+        acc.merge({'seen': ['y'], 'marks': {'m': {'b'}}})
+        self.assertEqual([('a', 2), ('b', 2)], list(state.clusters.items()))
+        self.assertEqual(['x', 'y'], state.seen)
+        self.assertEqual({'m': {'a', 'b'}}, state.marks)
+        self.assertRaises(dblexemplars.MergeError, acc.merge, {'seen': ['z'], 'script': 'Latn'})
+        self.assertEqual(['x', 'y'], state.seen)
+
+
+if __name__ == '__main__':
+    unittest.main()
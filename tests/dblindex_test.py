@@ -0,0 +1,79 @@
+#!/usr/bin/python
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+import os
+import sys
+import unittest
+
+try:
+    from wstools.dblindex import ProjectIndex
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib', 'wstools')))
+    from dblindex import ProjectIndex
+
+names = ["metadata.xml", "release/", "release/styles.xml", "release/USX_1/MAT.usx", "release/USX_1/041MRK.usx",
+         "release/abc.lds", "release/abc_Latn.ldml", "source/", "source/source/", "source/source/abc.ssf",
+         "source/source/styles.xml", "source/source/metadata.xml", "source/source/MATabc.usx",
+         "source/source/abc.ldml", "source/old.tar.gz", "release/README"]
+
+
+class IndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.index = ProjectIndex(names)
+
+    def test_ext(self):
+        for ext in ('usx', 'ldml', 'lds', 'ssf', 'xml'):
+            self.assertEqual([n for n in names if n.endswith("." + ext)], self.index.withExt(ext))
+        self.assertEqual(["release/USX_1/MAT.usx", "release/USX_1/041MRK.usx", "source/source/MATabc.usx"],
+                         self.index.withExt('usx'))
+        self.assertEqual(["source/old.tar.gz"], self.index.withExt('tar.gz'))
+        self.assertEqual([], self.index.withExt('Latn.ldml'))
+        self.assertEqual([], self.index.withExt('pdf'))
+        self.assertEqual("release/abc.lds", self.index.firstWithExt('lds'))
+        self.assertIsNone(self.index.firstWithExt('pdf'))
+
+    def test_role(self):
+        self.assertEqual(["release/styles.xml", "source/source/styles.xml"], self.index.withRole('stylesheet'))
+        self.assertEqual(["metadata.xml", "source/source/metadata.xml"], self.index.withRole('metadata'))
+        self.assertEqual(["release/abc_Latn.ldml", "source/source/abc.ldml"], self.index.withRole('ldml'))
+        self.assertEqual(["source/source/abc.ssf"], self.index.withRole('ssf'))
+        self.assertEqual(["release/abc.lds"], self.index.withRole('lds'))
+        self.assertEqual([], self.index.withRole('other'))
+
+    def test_members(self):
+        self.assertIn("metadata.xml", self.index)
+        self.assertIn("source/source/abc.ssf", self.index)
+        self.assertIn("release/README", self.index)
+        self.assertNotIn("abc.ssf", self.index)
+        self.assertNotIn("release/metadata.xml", self.index)
+        self.assertEqual(names, list(self.index))
+        self.assertEqual(len(names), len(self.index))
+
+
+if __name__ == '__main__':
+    unittest.main()
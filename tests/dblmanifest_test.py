@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+try:
+    from wstools import dblmanifest
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib', 'wstools')))
+    import dblmanifest
+
+
+class ManifestTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.zip = self.write("abc_0123.zip", "project")
+        self.sldr = os.path.join(self.dir, "sldr.xml")
+        self.out = self.write("out.xml", "output")
+        self.rules = dblmanifest.rulesDigest({'Font': ['Other', '', '', True]}, ['abc'], {'a', 'b'})
+        self.manifest = dblmanifest.BuildManifest(os.path.join(self.dir, "manifest.db"))
+        self.manifest.record(self.zip, self.rules, self.out, [(self.sldr, dblmanifest.fileDigest(self.sldr))])
+
+    def tearDown(self):
+        self.manifest.close()
+        shutil.rmtree(self.dir)
+
+    def write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as outf:
+            outf.write(text)
+        return path
+
+    def test_unchanged(self):
+        self.assertTrue(self.manifest.isCurrent(self.zip, self.rules))
+        # touched but not changed
+        st = os.stat(self.zip)
+        os.utime(self.zip, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.assertTrue(self.manifest.isCurrent(self.zip, self.rules))
+        self.assertFalse(self.manifest.isCurrent(os.path.join(self.dir, "other.zip"), self.rules))
+
+    def test_changes(self):
+        self.assertFalse(self.manifest.isCurrent(self.zip, dblmanifest.rulesDigest({'Font': []})))
+        self.write("sldr.xml", "now in the sldr")
+        self.assertFalse(self.manifest.isCurrent(self.zip, self.rules))
+        os.unlink(self.sldr)
+        self.assertTrue(self.manifest.isCurrent(self.zip, self.rules))
+        os.unlink(self.out)
+        self.assertFalse(self.manifest.isCurrent(self.zip, self.rules))
+        self.write("out.xml", "output")
+        self.write("abc_0123.zip", "new revision")
+        self.assertFalse(self.manifest.isCurrent(self.zip, self.rules))
+        self.manifest.record(self.zip, self.rules, self.out)
+        self.assertTrue(self.manifest.isCurrent(self.zip, self.rules))
+        self.manifest.forget(self.zip)
+        self.assertFalse(self.manifest.isCurrent(self.zip, self.rules))
+
+    def test_output_in_sldr(self):
+        # Building into the SLDR itself changes the SLDR file that was read
+        read = dblmanifest.fileDigest(self.out)
+        self.write("out.xml", "regenerated")
+        self.manifest.record(self.zip, self.rules, self.out, [(self.out, read)])
+        self.assertTrue(self.manifest.isCurrent(self.zip, self.rules))
+        self.write("out.xml", "edited by hand")
+        self.assertFalse(self.manifest.isCurrent(self.zip, self.rules))
+
+
+    def test_code(self):
+        res = dblmanifest.codeDigest(dblmanifest, dblmanifest.BuildManifest, unittest)
+        self.assertEqual(2, len(res))
+        self.assertEqual(("dblmanifest.py", dblmanifest.fileDigest(dblmanifest.__file__)), res[0])
+        self.assertNotEqual(dblmanifest.rulesDigest(res[:1]), dblmanifest.rulesDigest(res))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+try:
+    from wstools import dblpipeline, newdbl
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib', 'wstools')))
+    import dblpipeline, newdbl
+
+from fixtures import projectZip, tempTextCache
+
+
+class TextStage(dblpipeline.Stage):
+    """ Collects the text it is given """
+    name = "testtext"
+
+    def start(self, project):
+        self.texts = []
+
+    def consume(self, project, batch):
+        self.texts.extend(batch)
+
+    def finish(self, project):
+        return self.texts
+
+
+class PipelineTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        tempTextCache(self, self.tmpdir)
+        self.zipname = projectZip(self.tmpdir, {'release/test.lds': '[General]\nfont=Charis SIL\n'})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_stages(self):
+        stages = [TextStage(), TextStage(), dblpipeline.makeStage('fonts')]
+        stages[1].name = "testtext2"
+        d = newdbl.DBL()
+        d.open_project(self.zipname)
+        res = dblpipeline.Pipeline(stages).run(self.zipname, 'abc', dblobj=d)
+        self.assertEqual(list(d.analyze_text()), res['testtext'])
+        d.close_project()
+        self.assertEqual(res['testtext'], res['testtext2'])
+        self.assertEqual({'release/test.lds': ['Charis SIL']}, res['fonts'])
+        written = dblpipeline.writeArtifacts(stages, res, self.tmpdir, 'abc-Latn')
+        self.assertEqual([os.path.join(self.tmpdir, 'fonts', 'a', 'abc_Latn.tsv')], written)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, dblpipeline.makeStage, 'nosuchstage')
+
+
+if __name__ == '__main__':
+    unittest.main()
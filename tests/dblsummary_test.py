@@ -0,0 +1,86 @@
+#!/usr/bin/python
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import io
+import os
+import sys
+import unittest
+import multiprocessing
+
+try:
+    from wstools import dblsummary
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib', 'wstools')))
+    import dblsummary
+
+ProjectResult = dblsummary.ProjectResult
+
+
+def project(i):
+    """ A worker writing every third project to the same file """
+    if i % 5 == 4:
+        return ProjectResult("p{}.zip".format(i), "skipped", error="known bad")
+    return ProjectResult("p{}.zip".format(i), "done", "out{}.xml".format(i if i % 3 else 0),
+                         newfile=(i == 1), issues=("Font Missing",) if i == 2 else ())
+
+
+class SummaryTests(unittest.TestCase):
+
+    def test_summary(self):
+        progress = io.StringIO()
+        summary = dblsummary.runJobs(project, list(range(10)),
+                                     summary=dblsummary.RunSummary(total=10, progress=progress))
+        self.assertEqual(summary.count, 10)
+        self.assertEqual(summary.counts['done'], 8)
+        self.assertEqual(summary.counts['skipped'], 2)
+        self.assertEqual(summary.duplicates, {"out0.xml"})
+        self.assertEqual(summary.outputs["out0.xml"], ["p0.zip", "p3.zip", "p6.zip"])
+        self.assertEqual(summary.newfiles, {"out1.xml": "p1.zip"})
+        self.assertEqual(summary.issues, {"out2.xml": ["p2.zip", "Font Missing"]})
+        self.assertEqual(len(progress.getvalue().splitlines()), 10)
+        out = io.StringIO()
+        summary.report(out)
+        report = out.getvalue()
+        self.assertIn("\t('p3.zip', 'out0.xml')", report)
+        self.assertNotIn("p1.zip', 'out1.xml')", report.split("\n", 2)[2])
+        self.assertTrue(report.endswith("ALL DONE!\n"))
+
+    def test_pool(self):
+        pool = multiprocessing.Pool(processes=2)
+        try:
+            summary = dblsummary.runJobs(project, list(range(20)), pool)
+        finally:
+            pool.close()
+            pool.join()
+        serial = dblsummary.runJobs(project, list(range(20)))
+        self.assertEqual(summary.counts, serial.counts)
+        self.assertEqual(summary.duplicates, serial.duplicates)
+        self.assertEqual({k: sorted(v) for k, v in summary.outputs.items()},
+                         {k: sorted(v) for k, v in serial.outputs.items()})
+
+
+if __name__ == '__main__':
+    unittest.main()
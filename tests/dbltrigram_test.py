@@ -0,0 +1,80 @@
+#!/usr/bin/python
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import os
+import re
+import sys
+import shutil
+import tempfile
+import unittest
+
+try:
+    from wstools import dbltrigram
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib', 'wstools')))
+    import dbltrigram
+
+from fixtures import projectZip
+
+testdir = os.path.dirname(os.path.abspath(__file__))
+
+patterns = ['number="5"', 'verse', 'q2|nothere', r'mt\d', 'style="(fr|fq)"', 'chap(ter)+ ', 'x{3}yz',
+            '&', '<usx', 'qqqzzz', r'z</para>\s*</usx>']
+
+
+class TrigramTests(unittest.TestCase):
+    """ The index may only rule out members that the pattern cannot match """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.zipname = projectZip(self.tmpdir)
+        with open(os.path.join(testdir, 'MAT.usx'), 'rb') as inf:
+            self.text = inf.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_query(self):
+        grams = dbltrigram.textGrams(self.text)
+        for p in patterns:
+            query = dbltrigram.regexQuery(p)
+            if re.search(p, self.text.decode("utf-8")):
+                self.assertTrue(query is None or dbltrigram.matches(query, grams), p)
+        self.assertFalse(dbltrigram.matches(dbltrigram.regexQuery('qqqzzz'), grams))
+        self.assertIsNone(dbltrigram.regexQuery('(?i)verse'))
+        self.assertIsNone(dbltrigram.regexQuery('a.b|cd'))
+
+    def test_index(self):
+        with dbltrigram.TrigramIndex(os.path.join(self.tmpdir, "index.db")) as index:
+            self.assertEqual(1, index.update([self.zipname]))
+            self.assertEqual(0, index.update([self.zipname]))
+            found = index.candidates(dbltrigram.regexQuery('number="5"'), [self.zipname])
+            self.assertEqual({self.zipname: {(0, 'release/USX_1/MAT.usx')}}, found)
+            self.assertEqual({}, index.candidates(dbltrigram.regexQuery('qqqzzz'), [self.zipname]))
+
+
+if __name__ == '__main__':
+    unittest.main()
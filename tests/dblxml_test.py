@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+try:
+    from wstools import dbl, newdbl, dblxml
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib', 'wstools')))
+    import dbl, newdbl, dblxml
+
+from fixtures import projectZip, tempTextCache
+
+testdir = os.path.dirname(os.path.abspath(__file__))
+
+
+@unittest.skipIf(dblxml.lxmlET is None, "lxml is not installed")
+class XmlBackendTests(unittest.TestCase):
+    """ The lxml and standard library backends must extract the same text """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        tempTextCache(self, self.tmpdir)
+        self.zipname = projectZip(self.tmpdir)
+        self.default = dblxml.backend
+
+    def tearDown(self):
+        dblxml.useBackend(self.default)
+        shutil.rmtree(self.tmpdir)
+
+    def both(self, fn):
+        res = []
+        for b in ("stdlib", "lxml"):
+            dblxml.useBackend(b)
+            res.append(fn())
+        return res
+
+    def test_newdbl_text(self):
+        def extract():
+            d = newdbl.DBL()
+            # each backend must extract the text itself
+            d.textcache = None
+            d.open_project(self.zipname)
+            res = list(d.analyze_text())
+            d.close_project()
+            return res
+        (std, lx) = self.both(extract)
+        self.assertEqual(std, lx)
+        self.assertEqual('hkmnopqrstuvz', ''.join(lx))
+
+    def test_dbl_text(self):
+        def extract():
+            d = dbl.DBL(self.zipname)
+            d.textcache = None
+            res = list(d.analyze_text())
+            d.close_project()
+            return res
+        (std, lx) = self.both(extract)
+        self.assertEqual(std, lx)
+
+    def test_path(self):
+        def texts():
+            doc = dblxml.parse(os.path.join(testdir, 'MAT.usx'))
+            return dblxml.compilePath('para[@style="p"]')(doc)
+        (std, lx) = self.both(texts)
+        self.assertEqual(std, lx)
+        self.assertEqual(3, len(lx))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+try:
+    from wstools import ducetcache
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib', 'wstools')))
+    import ducetcache
+
+
+class DucetCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        env = mock.patch.dict(os.environ, {'WSTOOLS_DUCETCACHE': self.dir})
+        env.start()
+        self.addCleanup(env.stop)
+        self.table = {'a': [(0x1c47, 0x20, 0x2)], 'b': [(0x1c60, 0x20, 0x2)]}
+        reader = mock.patch.object(ducetcache._ducet, 'readDucet', side_effect=lambda: dict(self.table))
+        self.readDucet = reader.start()
+        self.addCleanup(reader.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def pickles(self):
+        return sorted(f for f in os.listdir(self.dir) if f.endswith(".pickle"))
+
+    def test_roundtrip(self):
+        self.assertEqual(self.dir, ducetcache.cacheDir())
+        self.assertEqual(self.table, ducetcache.loadDucet())
+        self.assertEqual(["ducet-{}.pickle".format(ducetcache.cacheKey())], self.pickles())
+        self.assertEqual(self.table, ducetcache.loadDucet())
+        self.assertEqual(1, self.readDucet.call_count)
+        self.assertEqual([], [f for f in os.listdir(self.dir) if f.endswith(".tmp")])
+
+    def test_corrupt(self):
+        ducetcache.loadDucet()
+        path = os.path.join(self.dir, self.pickles()[0])
+        with open(path, "wb") as outf:
+            outf.write(b"\x80\x05not a pickle")
+        self.assertEqual(self.table, ducetcache.loadDucet())
+        self.assertEqual(2, self.readDucet.call_count)
+        # and the rebuilt pickle is good again
+        self.assertEqual(self.table, ducetcache.loadDucet())
+        self.assertEqual(2, self.readDucet.call_count)
+
+    def test_missing(self):
+        ducetcache.loadDucet()
+        os.unlink(os.path.join(self.dir, self.pickles()[0]))
+        self.assertEqual(self.table, ducetcache.loadDucet())
+        self.assertEqual(2, self.readDucet.call_count)
+        self.assertEqual(1, len(self.pickles()))
+
+    def test_key(self):
+        ducetcache.loadDucet()
+        key = ducetcache.cacheKey()
+        with mock.patch.object(ducetcache, 'CACHEVERSION', ducetcache.CACHEVERSION + 1):
+            self.assertNotEqual(key, ducetcache.cacheKey())
+            self.assertEqual(self.table, ducetcache.loadDucet())
+        self.assertEqual(2, self.readDucet.call_count)
+        self.assertEqual(2, len(self.pickles()))
+
+    def test_unwritable(self):
+        os.environ['WSTOOLS_DUCETCACHE'] = os.path.join(self.dir, "file")
+        with open(os.environ['WSTOOLS_DUCETCACHE'], "w") as outf:
+            outf.write("in the way")
+        self.assertEqual(self.table, ducetcache.loadDucet())
+        self.assertEqual(self.table, ducetcache.loadDucet())
+        self.assertEqual(2, self.readDucet.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+# Fixtures shared by the tests
+
+import os
+import zipfile
+from unittest import mock
+
+testdir = os.path.dirname(os.path.abspath(__file__))
+
+
+def projectZip(tmpdir, extra=None, name="test.zip"):
+    """Make a small DBL project zip in tmpdir, of styles.xml as
+    release/styles.xml and MAT.usx as release/USX_1/MAT.usx, plus any
+    extra members given as a dict of name -> text. Returns its path."""
+    zipname = os.path.join(tmpdir, name)
+    with zipfile.ZipFile(zipname, "w") as z:
+        z.write(os.path.join(testdir, 'styles.xml'), 'release/styles.xml')
+        z.write(os.path.join(testdir, 'MAT.usx'), 'release/USX_1/MAT.usx')
+        for k, v in (extra or {}).items():
+            z.writestr(k, v)
+    return zipname
+
+
+def tempTextCache(testcase, tmpdir):
+    """Point the text cache at tmpdir/cache for the rest of testcase, to keep
+    extracted text out of the user's cache. Returns the cache directory."""
+    path = os.path.join(tmpdir, "cache")
+    env = mock.patch.dict(os.environ, {'WSTOOLS_TEXTCACHE': path})
+    env.start()
+    testcase.addCleanup(env.stop)
+    return path
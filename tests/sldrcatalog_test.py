@@ -0,0 +1,149 @@
+#!/usr/bin/python
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the University nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE REGENTS AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+try:
+    from wstools import sldrcatalog
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib', 'wstools')))
+    import sldrcatalog
+
+ldmltemplate = """<?xml version="1.0" encoding="UTF-8"?>
+<ldml xmlns:sil="urn://www.sil.org/ldml/0.1">
+  <identity>
+    <version number="{version}"/>
+    {generation}
+    <language type="{lang}"/>
+    <special>
+      <sil:identity source="{source}" script="Latn" defaultRegion="NG"/>
+    </special>
+  </identity>
+  <characters>
+    <exemplarCharacters>[a b c]</exemplarCharacters>
+    <exemplarCharacters type="auxiliary" alt="proposed-dbl">[q]</exemplarCharacters>
+    <exemplarCharacters type="auxiliary">[x y z]</exemplarCharacters>
+  </characters>
+  <layout><orientation><characterOrder>right-to-left</characterOrder></orientation></layout>
+  <special>
+    <sil:external-resources>
+      <sil:font name="Charis SIL" types="default" size="1.25"/>
+    </sil:external-resources>
+  </special>
+</ldml>
+"""
+
+
+class CatalogTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.sldr = os.path.join(self.dir, "sldr")
+        self.write("a", "abc_Latn.xml", lang="abc")
+        self.write("a", "ab.xml", lang="ab", source="cldr", generation="")
+        self.write("e", "en_GB.xml", lang="en")
+        self.write("e", "en.xml", lang="en")
+        self.catalog = sldrcatalog.SldrCatalog(self.sldr, path=os.path.join(self.dir, "catalog.db"))
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.dir)
+
+    def write(self, subdir, fname, lang, source="", version="20240101", generation='<generation date="2024-01-01"/>'):
+        os.makedirs(os.path.join(self.sldr, subdir), exist_ok=True)
+        path = os.path.join(self.sldr, subdir, fname)
+        with open(path, "w") as outf:
+            outf.write(ldmltemplate.format(lang=lang, source=source, version=version, generation=generation))
+        return path
+
+    def test_catalog(self):
+        self.assertEqual(self.catalog.refresh(), (4, 0))
+        info = self.catalog.get("abc-Latn")
+        self.assertEqual(info.path, os.path.join(self.sldr, "a", "abc_Latn.xml"))
+        self.assertEqual((info.tag, info.language, info.script), ("abc-Latn", "abc", "Latn"))
+        self.assertEqual(info.identity['defaultRegion'], "NG")
+        self.assertEqual((info.version, info.generation), ("20240101", "2024-01-01"))
+        self.assertEqual(info.exemplars, {'': "[a b c]", 'auxiliary': "[x y z]"})
+        self.assertEqual(info.fonts, [{'name': "Charis SIL", 'types': "default", 'size': "1.25"}])
+        self.assertEqual(info.direction, "right-to-left")
+        cldr = self.catalog.get("ab")
+        self.assertEqual((cldr.source, cldr.generation), ("cldr", None))
+        self.assertIsNone(self.catalog.get("xyz"))
+        self.assertEqual([i.tag for i in self.catalog.forLanguage("en")], ["en", "en-GB"])
+        self.assertEqual([i.tag for i in self.catalog.forDirectory("e")], ["en", "en-GB"])
+        self.assertEqual(len(list(self.catalog)), 4)
+
+    def test_refresh(self):
+        self.catalog.refresh()
+        self.assertEqual(self.catalog.refresh(), (0, 0))
+        path = self.write("a", "abc_Latn.xml", lang="abc", source="cldr")
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+        os.unlink(os.path.join(self.sldr, "e", "en_GB.xml"))
+        with open(os.path.join(self.sldr, "e", "broken.xml"), "w") as outf:
+            outf.write("<ldml>")
+        self.assertEqual(self.catalog.refresh(), (2, 1))
+        self.assertEqual(self.catalog.get("abc_Latn").source, "cldr")
+        self.assertIsNone(self.catalog.get("en-GB"))
+        self.assertIsNotNone(self.catalog.get("broken").error)
+
+    def test_current(self):
+        self.catalog.refresh()
+        self.assertIsNotNone(self.catalog.get("en", current=True))
+        # written since the refresh, say by an earlier project in the same run
+        path = self.write("e", "en.xml", lang="en", source="cldr")
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+        self.write("f", "fr.xml", lang="fr")
+        self.assertIsNotNone(self.catalog.get("en"))
+        self.assertIsNone(self.catalog.get("en", current=True))
+        self.assertIsNone(self.catalog.get("fr", current=True))
+        os.unlink(os.path.join(self.sldr, "a", "ab.xml"))
+        self.assertIsNone(self.catalog.get("ab", current=True))
+
+
+    def test_catalogFor(self):
+        os.environ['WSTOOLS_SLDRCATALOG'] = os.path.join(self.dir, "catalogs")
+        self.addCleanup(os.environ.pop, 'WSTOOLS_SLDRCATALOG')
+        self.addCleanup(sldrcatalog._catalogs.clear)
+        cat = sldrcatalog.catalogFor(self.sldr, refresh=False)
+        self.assertEqual(len(cat), 0)
+        self.assertIsNone(cat.get("en", current=True))
+        self.assertIs(sldrcatalog.catalogFor(self.sldr), cat)
+        self.assertEqual(len(cat), 4)
+        # a worker asking after the refresh walks nothing, but still sees changed files
+        self.write("e", "en.xml", lang="en", source="cldr", version="20250101")
+        self.write("f", "fr.xml", lang="fr")
+        self.assertIs(sldrcatalog.catalogFor(self.sldr, refresh=False), cat)
+        self.assertIs(sldrcatalog.catalogFor(self.sldr), cat)
+        self.assertEqual(len(cat), 4)
+        self.assertIsNone(cat.get("fr", current=True))
+
+
+if __name__ == '__main__':
+    unittest.main()